@@ -0,0 +1,202 @@
+""" Binary cache of parsed, masked and merged matchfile pairs """
+#   Copyright (c) 2015 by
+#   Richard Munoz <rmunoz@nygenome.org>
+#   Jie Yuan <jyuan@nygenome.org>
+#   Yaniv Erlich <yaniv@nygenome.org>
+#
+#   All rights reserved
+#   GPL license
+
+from ersa.parser import PairDict, RECORD_DTYPE, get_pair_dict, \
+    columns_to_records, records_to_columns
+from ersa.parser import _add_time
+from tempfile import NamedTemporaryFile
+from time import perf_counter
+import hashlib
+import numpy as np
+import os
+
+
+"""
+_CACHE_VERSION : int
+    bumped whenever the layout or meaning of cache files changes
+"""
+_CACHE_VERSION = 2
+
+
+def _get_umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+"""
+_FILE_MODE : int
+    permissions of the files written by write_arrays(), those of a
+    file created with open() under the umask at import time (read
+    once here, as os.umask() cannot be read without changing it)
+"""
+_FILE_MODE = 0o666 & ~_get_umask()
+
+
+def write_arrays(path, arrays):
+    """
+    Atomically writes a list of numpy arrays to one file at path
+    as consecutive records in the .npy format.
+
+    Parameters
+    ----------
+    path : str
+
+    arrays : list[numpy.ndarray]
+        arrays of fixed size dtypes (no python objects)
+    """
+    dirname = os.path.dirname(os.path.abspath(path))
+    with NamedTemporaryFile(dir=dirname, delete=False) as f:
+        try:
+            for a in arrays:
+                np.lib.format.write_array(f, np.ascontiguousarray(a),
+                                          allow_pickle=False)
+            # NamedTemporaryFile creates the file readable only by its owner
+            os.chmod(f.name, _FILE_MODE)
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    os.replace(f.name, path)
+
+
+def read_arrays(path, mmap=True):
+    """
+    Reads all arrays from a file written by write_arrays().
+
+    Parameters
+    ----------
+    path : str
+
+    mmap : bool
+        Memory map the arrays instead of reading them into memory
+
+    Returns
+    -------
+    arrays : list[numpy.ndarray]
+    """
+    arrays = []
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        while f.tell() < size:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+            count = int(np.prod(shape, dtype=np.int64))
+            order = 'F' if fortran_order else 'C'
+            if mmap and count > 0:
+                a = np.memmap(path, dtype=dtype, mode='r', offset=offset,
+                              shape=shape, order=order)
+            else:
+                a = np.fromfile(f, dtype=dtype, count=count).reshape(shape, order=order)
+            arrays.append(a)
+            f.seek(offset + count * dtype.itemsize)
+    return arrays
+
+
+def cache_key(path, t, user=None, haploscores=False, nomask=False, merge_len=-1, mask=None):
+    """
+    Returns a key identifying the contents of the matchfile at path
+    together with the get_pair_dict() parameters that change its
+    result.
+
+    Returns
+    -------
+    key : str
+        hexadecimal digest
+    """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    if user and not isinstance(user, str):
+        user = tuple(sorted(set(user)))
+    params = (_CACHE_VERSION, float(t), user, bool(haploscores), bool(nomask), int(merge_len))
+    if mask is not None and not nomask:
+        params += (mask.regions, mask.flank)
+    h.update(repr(params).encode())
+    return h.hexdigest()
+
+
+def save_pair_dict(path, pair_dict):
+    """
+    Writes the pairs and segments of pair_dict to a cache file at path.
+
+    Parameters
+    ----------
+    path : str
+
+    pair_dict : parser.PairDict
+        as returned by parser.get_pair_dict()
+    """
+    write_arrays(path, [np.array([_CACHE_VERSION], dtype=np.int64),
+                        np.array(pair_dict.names, dtype=str),
+                        pair_dict.offsets.astype(np.int64),
+                        columns_to_records(pair_dict.cols)])
+
+
+def load_pair_dict(path):
+    """
+    Reads a cache file written by save_pair_dict().  The segments
+    are memory mapped rather than read into memory.
+
+    Returns
+    -------
+    pair_dict : parser.PairDict
+    """
+    version, names, offsets, records = read_arrays(path)
+    assert version[0] == _CACHE_VERSION
+    assert records.dtype == RECORD_DTYPE
+    return PairDict(records_to_columns(names.tolist(), records), offsets)
+
+
+def get_cached_pair_dict(cache_dir, path, t, user=None, haploscores=False,
+                         nomask=False, merge_len=-1, jobs=1, mask=None, timings=None):
+    """
+    Returns parser.get_pair_dict() for the given arguments, loading
+    it from a cache file in cache_dir if one exists for the same
+    input and parameters, and creating the cache file otherwise.
+
+    Parameters
+    ----------
+    cache_dir : str
+        directory holding cache files, created if needed
+
+    path, t, user, haploscores, nomask, merge_len, jobs, mask, timings :
+        see parser.get_pair_dict(); path cannot be stdin, and
+        loading a cache file counts as reading
+
+    Returns
+    -------
+    pair_dict : parser.PairDict
+    """
+    if path == "-":
+        raise ValueError("input from stdin cannot be cached")
+    key = cache_key(path, t, user, haploscores, nomask, merge_len, mask)
+    cache_path = os.path.join(cache_dir, key + ".ersacache")
+    if os.path.exists(cache_path):
+        since = perf_counter()
+        try:
+            pair_dict = load_pair_dict(cache_path)
+        except (OSError, ValueError):
+            pass        # e.g. no read permission, parse the matchfile instead
+        else:
+            _add_time(timings, "read", since)
+            return pair_dict
+    pair_dict = get_pair_dict(path, t, user, haploscores, nomask, merge_len, jobs,
+                              mask=mask, timings=timings)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        save_pair_dict(cache_path, pair_dict)
+    except OSError:
+        pass            # e.g. a shared cache_dir that is not writable
+    return pair_dict
@@ -8,6 +8,7 @@
 #   GPL license
 
 from scipy.stats import chi2
+import numpy as np
 
 
 def LL_ratio_test(LLr, LLn, alpha=0.05, df=2):
@@ -45,3 +46,49 @@ def likelihood_ratio_CI(alts, max_alt_LL, alpha=0.05, df=2):
             elif d > upper_d:
                 upper_d = d
     return lower_d, upper_d
+
+
+def LL_ratio_tests(LLr, LLn, alpha=0.05, df=2):
+    """
+    Array version of LL_ratio_test() that tests every element of
+    LLr (alternative) against the matching element of LLn (null).
+
+    Parameters
+    ----------
+    LLr: array of log-likelihoods of the alternatives
+    LLn: array of log-likelihoods of the nulls, broadcast against LLr
+    df: degrees of freedom for the ratio test
+    alpha: confidence level
+
+    Returns
+    -------
+    reject : numpy.ndarray[bool]
+    """
+    ratio = -2 * np.asarray(LLn) + 2 * np.asarray(LLr)
+    p = 1 - chi2.cdf(ratio, df)
+    return p < alpha
+
+
+def likelihood_ratio_CIs(alt_LLs, max_alt_LLs, alpha=0.05, df=2):
+    """
+    Array version of likelihood_ratio_CI() for many sets of
+    alternative models at once.
+
+    Parameters
+    ----------
+    alt_LLs : numpy.ndarray[float]
+        alt_LLs[i, d - 1] is the log-likelihood of d for the i-th set
+
+    max_alt_LLs : numpy.ndarray[float]
+        log-likelihood of the maximum model of each set
+
+    Returns
+    -------
+    lower_d, upper_d : (numpy.ndarray[int], numpy.ndarray[int])
+        bounds on d for each set, 0 where no d is within the interval
+    """
+    inside = ~LL_ratio_tests(max_alt_LLs[:, None], alt_LLs, alpha, df)
+    found = inside.any(axis=1)
+    lower_d = np.where(found, inside.argmax(axis=1) + 1, 0)
+    upper_d = np.where(found, inside.shape[1] - inside[:, ::-1].argmax(axis=1), 0)
+    return lower_d, upper_d
@@ -8,14 +8,42 @@
 #   GPL license
 
 from sqlalchemy.pool import StaticPool
-from sqlalchemy.sql import select
-from sqlalchemy import create_engine
+from sqlalchemy.sql import select, func, text
+from sqlalchemy import create_engine, Table, MetaData, Column, String, and_
 from sqlalchemy.engine import reflection
+from sqlalchemy.schema import CreateTable
 from .dbmodels.base import Base
 from .dbmodels.ersa_result import Result
 from .dbmodels.ersa_segment import Segment
 from .ersa_LL import Estimate
-from .parser import SharedSegment
+from .parser import SharedSegment, SegmentSlice
+
+
+"""
+_SOFT_DELETE_PAIRS : sqlalchemy.Table
+    temporary table of the pairs passed to Database.soft_delete(),
+    in both orientations; it stays with the connection and is
+    emptied before and after each use
+"""
+_SOFT_DELETE_PAIRS = Table("ersa_soft_delete_pairs", MetaData(),
+                           Column("indv1", String(250), primary_key=True),
+                           Column("indv2", String(250), primary_key=True),
+                           prefixes=["TEMPORARY"])
+
+
+def _segment_rows(seg_list):
+    """
+    Returns
+    -------
+    rows : iterable[(int, int, int, float)]
+        the chromosome, start, end and length of the segments of
+        seg_list, read from the columns of an ersa.parser.SegmentSlice
+        without creating a SharedSegment per segment
+    """
+    if isinstance(seg_list, SegmentSlice):
+        return zip(seg_list.chrom.tolist(), seg_list.bp_start.tolist(),
+                   seg_list.bp_end.tolist(), seg_list.length.tolist())
+    return ((seg.chrom, seg.bpStart, seg.bpEnd, seg.length) for seg in seg_list)
 
 
 class Database:
@@ -67,30 +95,34 @@ class Database:
             List of pairs, with each individual's id separated
             by ":"
         """
-        keys = []
+        keys = set()
         for p in pairs:
             indv1, indv2 = p.split(":")
-            s = select([Result.__table__]). \
-                where((~ Result.__table__.c.deleted) &
-                      (((Result.__table__.c.indv1 == indv1) & (Result.__table__.c.indv2 == indv2)) |
-                       ((Result.__table__.c.indv1 == indv2) & (Result.__table__.c.indv2 == indv1))))
-            res = self.conn.execute(s)
-            for row in res:
-                keys.append(row[Result.__table__.c.id])
-        n = 0
-        if keys:
-            remainder = len(keys)
-            while remainder > 0:
-                i = 900 if remainder > 900 else remainder
-
-                u = Result.__table__.update(). \
-                    where(Result.__table__.c.id.in_(keys[-i:])). \
-                    values(deleted=True)
-                u_result = self.conn.execute(u)
-                n += u_result.rowcount
-
-                remainder -= i
-                del keys[-i:]
+            keys.add((indv1, indv2))
+            keys.add((indv2, indv1))
+        if not keys:
+            return 0
+
+        # one joined UPDATE over a temporary table of the pairs,
+        # instead of a SELECT per pair.  The table may remain from a
+        # soft_delete() that failed on this connection, so it is only
+        # created if missing and emptied first.
+        results, tmp = Result.__table__, _SOFT_DELETE_PAIRS
+        create = str(CreateTable(tmp).compile(dialect=self.engine.dialect))
+        self.conn.execute(create.replace("CREATE TEMPORARY TABLE", "CREATE TEMPORARY TABLE IF NOT EXISTS", 1))
+        self.conn.execute(tmp.delete())
+        self.conn.execute(tmp.insert(),
+                          [{'indv1': indv1, 'indv2': indv2} for indv1, indv2 in keys])
+        ids = select([results.c.id]). \
+            select_from(results.join(tmp, and_(results.c.indv1 == tmp.c.indv1,
+                                               results.c.indv2 == tmp.c.indv2))). \
+            where(~ results.c.deleted)
+        u = results.update(). \
+            where(results.c.id.in_(ids)). \
+            values(deleted=True)
+        n = self.conn.execute(u).rowcount
+        self.conn.execute(tmp.delete())
+        if n:
             print("marked {:,} results deleted".format(n))
         return n
 
@@ -116,9 +148,8 @@ class Database:
         if not self.skip_soft_delete:
             self.soft_delete(pairs)
 
-        for i in range(len(ests)):
-            est, seg_list = ests[i], seg_lists[i]
-
+        results, segments = [], []      # segments[i]: rows of the segments of results[i]
+        for est, seg_list in zip(ests, seg_lists):
             d_est = est.d if est.reject else None
             np = est.np if est.reject else len(est.s)
             rel_est1 = est.rel_est[0] if est.rel_est else None
@@ -132,24 +163,62 @@ class Database:
                 else:
                     LLs += ","
             total_bp = 0
-            for seg in seg_list:
-                total_bp += seg.bpEnd - seg.bpStart + 1
-
+            seg_rows = []
+            for chrom, bp_start, bp_end, length in _segment_rows(seg_list):
+                total_bp += bp_end - bp_start + 1
+                seg_rows.append({'chromosome': chrom, 'bp_start': bp_start, 'bp_end': bp_end,
+                                 'length': length})
+            segments.append(seg_rows)
+
+            results.append({'indv1': est.indv1, 'indv2': est.indv2,
+                            'd_est': d_est, 'rel_est1': rel_est1, 'rel_est2': rel_est2,
+                            'n': len(est.s), 'total_cM': est.cm, 'total_bp': total_bp,
+                            'LLs': LLs, 'na': (len(est.s) - np)})
+        if not results:
+            return
+
+        # where result ids can be reserved up front, all results and all
+        # segments are inserted with one executemany each
+        result_ids = self._reserve_result_ids(len(results))
+        if result_ids is not None:
+            for row, result_id in zip(results, result_ids):
+                row['id'] = result_id
+            self.conn.execute(Result.__table__.insert(), results)
+        else:
             insert_result = Result.__table__.insert()
-            inserted_result = self.conn.execute(insert_result, indv1=est.indv1, indv2=est.indv2,
-                                                d_est=d_est, rel_est1=rel_est1, rel_est2=rel_est2,
-                                                n=len(est.s), total_cM=est.cm,
-                                                total_bp=total_bp, LLs=LLs,
-                                                na=(len(est.s) - np))
-            result_id = inserted_result.inserted_primary_key[0]
-
-            if len(seg_list) > 0:
-                insert_seg = Segment.__table__.insert()
-                self.conn.execute(insert_seg,
-                                  [{'result_id': result_id, 'chromosome': seg.chrom,
-                                    'bp_start': seg.bpStart, 'bp_end': seg.bpEnd,
-                                    'length': seg.length}
-                                   for seg in seg_list])
+            result_ids = [self.conn.execute(insert_result, row).inserted_primary_key[0]
+                          for row in results]
+        seg_rows = []
+        for result_id, rows in zip(result_ids, segments):
+            for row in rows:
+                row['result_id'] = result_id
+            seg_rows.extend(rows)
+        if seg_rows:
+            self.conn.execute(Segment.__table__.insert(), seg_rows)
+
+    def _reserve_result_ids(self, n):
+        """
+        Returns n unused ids for new results, which stay unused by
+        concurrent writers, or None if the database does not allow it.
+
+        On PostgreSQL the ids are taken from the id sequence.  On SQLite
+        the transaction first takes the database's write lock, so that
+        other writers wait for its commit, and the ids follow the
+        largest id in the table, as SQLite would assign them.  Results
+        are inserted one at a time on other databases.
+        """
+        results = Result.__table__
+        dialect = self.engine.dialect.name
+        if dialect == "postgresql":
+            q = text("SELECT nextval(pg_get_serial_sequence('{}', 'id')) "
+                     "FROM generate_series(1, :n)".format(results.name))
+            return [row[0] for row in self.conn.execute(q, n=n)]
+        if dialect == "sqlite":
+            # an UPDATE of no rows is enough to take the write lock
+            self.conn.execute(results.update().where(results.c.id < 0).values(deleted=True))
+            max_id = self.conn.execute(select([func.max(results.c.id)])).scalar() or 0
+            return list(range(max_id + 1, max_id + 1 + n))
+        return None
 
     def delete(self):
         """
@@ -183,6 +252,14 @@ class Database:
         """ push changes in the current transaction to the database """
         self.trans.commit()
 
+    def checkpoint(self):
+        """
+        Pushes changes in the current transaction to the database
+        and begins a new transaction
+        """
+        self.trans.commit()
+        self.trans = self.conn.begin()
+
     def rollback(self):
         """ discards changes in the current transaction """
         self.trans.rollback()
@@ -7,17 +7,33 @@
 #   GPL license
 
 
-from .ersa_LL import Background, Relation, estimate_relation
-from .parser import get_pair_dict
+from .ersa_LL import Background, Relation, CriticalTable, EstimateCache, estimate_relations, \
+    rel_estimate
+from .parser import PREPROCESS_STEPS, get_pair_dict, iter_sorted_pairs
+from .partition import iter_partitioned_pairs
+from .cache import get_cached_pair_dict
+from .index import build_index, index_path, load_index, save_index
+from .mask import load_mask
+from .parallel import chunk_arrays, imap_estimates, iter_chunks
+from .pipeline import WriterThread, iter_threaded
 from time import time
 from sys import stdout
 from argparse import ArgumentParser
 from .dbmanager import DbManager
+import numpy as np
 
 
-def get_args():
+"""
+_QUEUE_SIZE : int
+    number of chunks of pairs that may wait between reading and
+    estimating, and between estimating and writing
+"""
+_QUEUE_SIZE = 16
+
+
+def get_args(argv=None):
     p = ArgumentParser(description="estimate combined number of generations between pairs of individuals")
-    p.add_argument("matchfile", help="input match file")
+    p.add_argument("matchfile", help="input match file, optionally gzip, bgzip, bzip2 or xz compressed (\"-\" reads from stdin)")
     p.add_argument("-a", "--alpha", help="significance level (default: %(default).2f)",
                    type=float, default=0.05)
     p.add_argument("--avuncular-adj", help="apply the adjustment to Na from Li et al. (2014) for avuncular (a=2, d=3) relationships",
@@ -26,24 +42,40 @@ def get_args():
                    type=int, default=22)
     p.add_argument("-ci", help="generate confidence intervals",
                    action='store_true')
+    p.add_argument("--db-batch-size", help="with -D, insert and commit results every DB_BATCH_SIZE kept pairs; 0 commits once at the end (default: %(default)d)",
+                   type=int, default=10000)
     p.add_argument("-d", "--dmax", help="max combined number of generations to test (default: %(default)d)",
                    type=int, default=10)
+    p.add_argument("--build-index", help="(re)build the index of MATCHFILE by individual, used to speed up later runs with -u",
+                   action="store_true")
+    p.add_argument("--estimate-cache", help="number of segment length profiles whose likelihoods are kept for reuse by later pairs (default: %(default)d, 0 disables)",
+                   type=int, default=2 ** 16)
     p.add_argument("--first_deg_adj", help="Include adjustments for first-degree relationships",
                    action="store_true")
     p.add_argument("-H", help="input matchfile contains an extra column at the end of each line with haploscores (discarded by ersa)",
                    action='store_true')
+    p.add_argument("-j", "--jobs", help="number of processes to use for reading and estimating (default: %(default)d)",
+                   type=int, default=1)
     p.add_argument("-l", help="mean number of segments shared in the population (default: %(default).1f)",
                    type=float, default=13.73)
     p.add_argument("--merge-segs", help="merge segments that are on the same chromosome and <= MERGE-SEGS bp apart (default No merge)",
                    type=int, default=-1)
+    p.add_argument("--mask", help="BED-like file of genomic regions to mask, with the chromosome, start, end and length in cM of each region (default: the regions of Huff et al. 2014, Table 3)",
+                   type=str, default=None)
     p.add_argument("--nomask", help="disable genomic region masking",
                    action="store_true")
     p.add_argument("-r", help="expected number of recombination events per haploid genome per generation (default %(default).1f for humans)",
                    type=float, default=35.2548101)
     p.add_argument("-t", help="min segment length (in cM) to include in comparisons (default %(default).1f)",
                    type=float, default=2.5)
-    p.add_argument("-u", "--user", help="filter input file to only look at USER",
-                   type=str)
+    p.add_argument("-u", "--user", help="filter input file to only look at pairs involving USER; may be repeated to look at pairs involving any of the USERs",
+                   type=str, action="append")
+    p.add_argument("--users-file", help="like -u, with users read from USERS_FILE (one per line)",
+                   type=str, default=None)
+    p.add_argument("--timings", help="report the time taken by each step of reading and preprocessing the input",
+                   action="store_true")
+    p.add_argument("--tmpdir", help="directory for temporary files (default: system temporary directory)",
+                   type=str, default=None)
     p.add_argument("-th", "--theta", help="mean shared segment length (in cM) in the population (default %(default).3f)",
                    type=float, default=3.197036753)
     p.add_argument("--skip-soft-delete", help="Assume the database is empty, don't soft-delete before inserting new data",
@@ -61,23 +93,150 @@ def get_args():
     group2.add_argument("--keep-insignificant", help="push insignificant results to the database where d_est is NULL (default: discard below INSIG-THRESHOLD)",
                         action='store_true')
 
-    args = p.parse_args()
+    group3 = p.add_mutually_exclusive_group()
+    group3.add_argument("--sorted-input", help="input lines are grouped by pair of individuals; estimate each pair as soon as it is read instead of loading the whole file",
+                        action='store_true')
+    group3.add_argument("--memory-budget", help="process input larger than memory by splitting it by pair into temporary files that each fit in MEMORY_BUDGET MB (default: off)",
+                        type=float, default=None)
+    group3.add_argument("--cache", help="directory of cached, preprocessed input; reuse the cache for this matchfile and -t, -u, -H, --mask, --nomask and --merge-segs if present, create it otherwise (default: off)",
+                        type=str, default=None)
+
+    args = p.parse_args(argv)
+    if args.memory_budget and args.matchfile == "-":
+        p.error("--memory-budget cannot be used with input from stdin, whose size is not known in advance")
+    if args.users_file:
+        with open(args.users_file) as users_file:
+            args.user = (args.user or []) + [line.strip() for line in users_file if line.strip()]
+    if args.user:
+        args.user = sorted(set(args.user))
     return args
 
 
-def gen_estimates(args, h0, ha, pair_dict):
+def gen_chunk_estimates(args, h0, ha, pairs, cache=None, prune=None):
+    """
+    Estimates chunks of pairs of about the same cost with
+    ersa_LL.estimate_relations(), over args.jobs processes.  pairs
+    are read in a separate thread, up to _QUEUE_SIZE chunks ahead
+    of estimation.
+
+    Parameters
+    ----------
+    pairs : iterable[((str, str), ersa.parser.SegmentSlice)]
+        Pairs of individual identifiers and their segments,
+        e.g. get_pair_dict().named_items()
+
+    cache : ersa_LL.EstimateCache | None
+
+    prune : ersa_LL.CriticalTable | None
+        skips the alternatives of pairs that cannot be significant
+
+    Returns
+    -------
+    results : generator[(list, numpy.ndarray[float], numpy.ndarray[int64], ersa_LL.Estimates)]
+        the pairs of each chunk, their segment lengths and offsets
+        and their estimates, in the order of pairs; see
+        parallel.imap_estimates()
     """
+    chunks = iter_threaded(iter_chunks(pairs, args.dmax, args.first_deg_adj), _QUEUE_SIZE)
+    if args.jobs > 1:
+        yield from imap_estimates(chunks, args.jobs, h0, ha, args.dmax, args.alpha, args.ci, cache, prune,
+                                  tmpdir=args.tmpdir)
+        return
+    for chunk, _ in chunks:
+        lengths, offsets = chunk_arrays(chunk)
+        ests = estimate_relations(lengths, offsets, h0, ha, args.dmax, args.alpha, args.ci, cache, prune)
+        yield chunk, lengths, offsets, ests
+
+
+def _chunk_estimate(chunk, lengths, offsets, ests, i):
+    """ Returns the Estimate of the i-th pair of a result of gen_chunk_estimates() """
+    pair = chunk[i][0]
+    dob = (None, None)  # TODO get dob from file
+    s = lengths[offsets[i]:offsets[i + 1]].tolist()
+    return ests.estimate(i, pair, dob, s)
+
+
+def gen_estimates(args, h0, ha, pairs, cache=None, prune=None):
+    """
+    Like gen_chunk_estimates(), one Estimate per pair.
+
     Returns
     -------
-    (est, seg_list) : (Estimate, list[ersa.parser.SharedSegment])
-        Tuple of estimate results and corresponding segment list.
+    (est, seg_list) : (Estimate, ersa.parser.SegmentSlice)
+        Tuple of estimate results and corresponding segments,
+        in the order of pairs.
     """
-    for pair, seg_list in pair_dict.items():
-        dob = (None, None)  # TODO get dob from file
-        s = [seg.length for seg in seg_list]
-        n = len(s)
-        est = estimate_relation(pair, dob, n, s, h0, ha, args.dmax, args.alpha, args.ci)
-        yield est, seg_list
+    for chunk, lengths, offsets, ests in gen_chunk_estimates(args, h0, ha, pairs, cache, prune):
+        for i, (_, seg_list) in enumerate(chunk):
+            yield _chunk_estimate(chunk, lengths, offsets, ests, i), seg_list
+
+
+def _keep_result(args, reject, cm, seg_list):
+    """ Returns True if the result of a pair is to be pushed to the database """
+    keep = False
+    if args.keep_insig_by_seg:
+        n_needed = args.keep_insig_by_seg[0]
+        l_needed = args.keep_insig_by_seg[1]
+        count = int(np.count_nonzero(seg_list.length > l_needed))
+        keep = True if count > n_needed else False
+    # 'reject' => H0 is rejected, this pair is significant.
+    return bool(reject or args.keep_insignificant or
+                (args.insig_threshold and cm >= args.insig_threshold) or
+                (args.keep_insig_by_seg and keep))
+
+
+def _write_db(args, batches, totals):
+    """
+    Writer of main() for -D, inserts the kept results of the batches
+    of gen_chunk_estimates() in batches of about args.db_batch_size
+    pairs, committing after each insert so that only the current batch
+    is held in memory and in the open transaction.  An Estimate is only
+    made for the pairs kept.  Adds the numbers of pairs and segments
+    inserted to totals.  Runs in the writer thread, which must own the
+    database connection.
+    """
+    def flush(db, ests, seg_lists):
+        db.insert(ests, seg_lists)
+        totals["pairs"] += len(ests)
+        totals["segments"] += sum(len(seg_list) for seg_list in seg_lists)
+        if args.db_batch_size > 0:
+            db.checkpoint()
+
+    with DbManager(args.D, skip_soft_delete=args.skip_soft_delete) as db:
+        ests, seg_lists = [], []
+        for chunk, lengths, offsets, chunk_ests in batches:
+            offsets = offsets.tolist()
+            for i, (reject, cm) in enumerate(zip(chunk_ests.reject.tolist(), chunk_ests.cm.tolist())):
+                seg_list = chunk[i][1]
+                if _keep_result(args, reject, cm, seg_list):
+                    ests.append(_chunk_estimate(chunk, lengths, offsets, chunk_ests, i))
+                    seg_lists.append(seg_list)
+            if len(ests) >= args.db_batch_size > 0:
+                flush(db, ests, seg_lists)
+                ests, seg_lists = [], []
+        if ests:
+            flush(db, ests, seg_lists)
+
+
+def _write_text(output_file, batches):
+    """
+    Writer of main() for text output, prints one line per pair of the
+    batches of gen_chunk_estimates(), read from the columns of their
+    Estimates
+    """
+    print("{:<20} {:<20} {:<10} {:<10} {:>10} {:>10} {:>10}"
+          .format("Indv_1", "Indv_2", "Rel_est1", "Rel_est2", "d_est", "N_seg", "Tot_cM"),
+          file=output_file)
+    no_rel_est = ("NA", "NA")
+    for chunk, _, _, ests in batches:
+        columns = zip(chunk, ests.reject.tolist(), ests.d.tolist(), ests.n.tolist(), ests.cm.tolist())
+        for (pair, _), reject, d, n, s in columns:
+            # Estimate.d is the relationship degree, d - 1
+            d_est = d - 1 if reject else "NA"
+            rel_est = (rel_estimate(d) if reject else None) or no_rel_est
+            print("{:<20} {:<20} {:10} {:10} {:>10} {:10} {:10,.2f}"
+                  .format(pair[0], pair[1], rel_est[0], rel_est[1], d_est, n, s),
+                  file=output_file)
 
 
 def main():
@@ -87,54 +246,81 @@ def main():
 
     print("--- Reading match file ---")
 
-    pair_dict = get_pair_dict(args.matchfile, args.t, args.user, args.H, args.nomask, args.merge_segs)
+    index = None
+    if args.build_index:
+        index = build_index(args.matchfile, args.H)
+        save_index(index_path(args.matchfile), index)
+    elif args.user and args.matchfile != "-":
+        index = load_index(index_path(args.matchfile))
+        if index is not None and not index.is_current(args.matchfile):
+            print("ignoring out of date index {}".format(index_path(args.matchfile)))
+            index = None
+    if not args.user:
+        index = None
+
+    mask = load_mask(args.mask) if args.mask else None
+    timings = {} if args.timings else None
+
+    if args.sorted_input:
+        pairs = iter_sorted_pairs(args.matchfile, args.t, args.user, args.H, args.nomask, args.merge_segs,
+                                  mask, timings)
+        n_pairs = None
+    elif args.memory_budget:
+        pairs = iter_partitioned_pairs(args.matchfile, args.t, int(args.memory_budget * 2 ** 20),
+                                       args.user, args.H, args.nomask, args.merge_segs, args.tmpdir, mask,
+                                       timings)
+        n_pairs = None
+    else:
+        if args.cache:
+            pair_dict = get_cached_pair_dict(args.cache, args.matchfile, args.t, args.user, args.H,
+                                             args.nomask, args.merge_segs, args.jobs, mask, timings)
+        else:
+            pair_dict = get_pair_dict(args.matchfile, args.t, args.user, args.H, args.nomask,
+                                      args.merge_segs, args.jobs, index, mask, timings)
+        pairs = pair_dict.named_items()
+        n_pairs = len(pair_dict)
 
     h0 = Background(args.t, args.theta, args.l)
     ha = Relation(args.c, args.r, args.t, args.theta, args.l,
-                  args.first_deg_adj, args.nomask, args.avuncular_adj)
+                  args.first_deg_adj, args.nomask, args.avuncular_adj, mask)
+    est_cache = EstimateCache(args.estimate_cache) if args.estimate_cache > 0 else None
+    # the likelihoods of insignificant pairs are only written when they are kept
+    keep_insig = args.D and (args.keep_insignificant or args.insig_threshold or args.keep_insig_by_seg)
+    prune = None if keep_insig else CriticalTable(h0, ha, args.dmax, args.alpha)
 
     print("--- {} seconds ---".format(round(time() - start_time, 3)))
     print()
 
     print("--- Solving ---")
 
+    # reading, estimating and writing overlap, in threads connected by bounded queues
     if args.D:
-        n_pairs = len(pair_dict)
-        print("processing {:,} pairs..".format(n_pairs))
-        ests, seg_lists = [], []
-        total_segs = 0
-        for est, seg_list in gen_estimates(args, h0, ha, pair_dict):
-            keep = False
-            if args.keep_insig_by_seg:
-                n_needed = args.keep_insig_by_seg[0]
-                l_needed = args.keep_insig_by_seg[1]
-                count = sum(i.length > l_needed for i in seg_list)
-                keep = True if count > n_needed else False
-            # 'reject' => H0 is rejected, this pair is significant.
-            if est.reject or args.keep_insignificant or \
-                    (args.insig_threshold and est.cm >= args.insig_threshold) or \
-                    (args.keep_insig_by_seg and keep):
-                ests.append(est)
-                seg_lists.append(seg_list)
-                total_segs += len(seg_list)
-        print("pushing results from '{}' to database... " \
-              "({} pairs, {} segments)".format(args.matchfile, len(ests), total_segs))
-        with DbManager(args.D, skip_soft_delete=args.skip_soft_delete) as db:
-            db.insert(ests, seg_lists)
+        if n_pairs is not None:
+            print("processing {:,} pairs..".format(n_pairs))
+        totals = {"pairs": 0, "segments": 0}
+        with WriterThread(lambda batches: _write_db(args, batches, totals), _QUEUE_SIZE) as writer:
+            for results in gen_chunk_estimates(args, h0, ha, pairs, est_cache, prune):
+                writer.put(results)
+        print("pushed results from '{}' to database " \
+              "({} pairs, {} segments)".format(args.matchfile, totals["pairs"], totals["segments"]))
     else:
         output_file = open(args.ofile, "w") if args.ofile else stdout
-        print("{:<20} {:<20} {:<10} {:<10} {:>10} {:>10} {:>10}"
-              .format("Indv_1", "Indv_2", "Rel_est1", "Rel_est2", "d_est", "N_seg", "Tot_cM"),
-              file=output_file)
-        for est, seg_list in gen_estimates(args, h0, ha, pair_dict):
-            d_est = est.d if est.reject else "NA"
-            s = est.cm
-            if est.rel_est is None:
-                rel_est = ("NA", "NA")
-            else:
-                rel_est = est.rel_est
-            print("{:<20} {:<20} {:10} {:10} {:>10} {:10} {:10,.2f}"
-                  .format(est.indv1, est.indv2, rel_est[0], rel_est[1], d_est, len(seg_list), s),
-                  file=output_file)
+        with WriterThread(lambda batches: _write_text(output_file, batches), _QUEUE_SIZE) as writer:
+            for results in gen_chunk_estimates(args, h0, ha, pairs, est_cache, prune):
+                writer.put(results)
+        if args.ofile:
+            output_file.close()
+
+    if timings is not None:
+        print()
+        print("--- Preprocessing steps ---")
+        for step in PREPROCESS_STEPS:
+            if step in timings:
+                print("{:<10} {:>10.3f} seconds".format(step, timings[step]))
+        print()
 
+    if est_cache is not None:
+        print("estimate cache: {:,} hits, {:,} misses".format(est_cache.hits, est_cache.misses))
+    if prune is not None:
+        print("pruned {:,} pairs that cannot be significant".format(prune.pruned))
     print("--- {} seconds ---".format(round(time() - start_time, 3)))
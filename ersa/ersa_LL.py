@@ -10,11 +10,76 @@ to estimate relationships.
 #   All rights reserved
 #   GPL license
 
-from math import exp, log, factorial, log1p
+from math import exp, log, log1p
+from functools import lru_cache
+from collections import OrderedDict
 from operator import itemgetter
-from ersa.chisquare import LL_ratio_test, likelihood_ratio_CI
+from ersa.chisquare import LL_ratio_test, likelihood_ratio_CI, LL_ratio_tests, likelihood_ratio_CIs
+from scipy.stats import chi2
 from ersa.mask import total_masked
 import inflect
+import numpy as np
+
+
+"""
+_LOG_FACTORIALS : list[float]
+    _LOG_FACTORIALS[k] == log(factorial(k)), extended by _log_factorial()
+
+_FACTORIAL : list[int]
+    factorial(len(_LOG_FACTORIALS) - 1), the last factorial tabulated
+"""
+_LOG_FACTORIALS = [0.0]
+_FACTORIAL = [1]
+
+
+def _log_factorial(n):
+    """ Returns log(factorial(n)) from a table grown as needed """
+    while len(_LOG_FACTORIALS) <= n:
+        _FACTORIAL[0] *= len(_LOG_FACTORIALS)
+        _LOG_FACTORIALS.append(log(_FACTORIAL[0]))
+    return _LOG_FACTORIALS[n]
+
+
+"""
+_LOG_FACTORIAL_SUMS : list[float]
+    _LOG_FACTORIAL_SUMS[k] == log(2) + ... + log(k - 1), added in that
+    order, for the terms of _first_deg_series()
+"""
+_LOG_FACTORIAL_SUMS = [0, 0, 0]
+
+
+@lru_cache(maxsize=2 ** 16)
+def _first_deg_series(i, k_max=200):
+    """
+    Returns log(sum over k = 1, ..., k_max of x^(k - 1) / (k - 1)!) with
+    x = i / 100, the series of Li et al (2014) Eqn 6 used by Relation._Fa().
+
+    The terms are added in order of k and the loop stops once they are
+    decreasing and too small to change the sum, which gives the same
+    value as adding all k_max terms.
+    """
+    while len(_LOG_FACTORIAL_SUMS) <= k_max:
+        k = len(_LOG_FACTORIAL_SUMS)
+        _LOG_FACTORIAL_SUMS.append(_LOG_FACTORIAL_SUMS[k - 1] + log(k - 1))
+    log_x = log(i / 100)
+    sum = 0
+    for k in range(2, k_max + 1):
+        # l_ai = k * log(1/2) + (k-1) * log(l) - (d * l) / 100
+        #      - k * log(100/d) - log(factorial(k - 1))
+        diff = (k - 1) * log_x
+        diff -= _LOG_FACTORIAL_SUMS[k]
+        term = exp(diff)
+        if sum + term == sum and k > 2 * i / 100:
+            break
+        sum += term
+    return log1p(sum)
+
+
+def _log_factorials(n):
+    """ Returns the array of log(factorial(k)) for k = 0, ..., n """
+    _log_factorial(n)
+    return np.array(_LOG_FACTORIALS[:n + 1])
+
 
 class Background:
     """
@@ -83,7 +148,7 @@ class Background:
         return result
 
     def _Np(self, n):
-        l_prob = n * log(self.lambda_) - self.lambda_ - log(factorial(n))
+        l_prob = n * log(self.lambda_) - self.lambda_ - _log_factorial(n)
         return l_prob
 
     def LL(self, n, s):
@@ -186,17 +251,19 @@ class Relation(Background):
     -------
     Class Background
     """
-    def __init__(self, c, r, t, theta, lambda_, first_deg_adj=False, nomask=False, avuncular_adj=False):
+    def __init__(self, c, r, t, theta, lambda_, first_deg_adj=False, nomask=False, avuncular_adj=False,
+                 mask=None):
         super(Relation, self).__init__(t, theta, lambda_)
         self.c = c
         if nomask:
             self.r = r
         else:
-            m = total_masked()
+            m = total_masked(mask)
             self.r = r - m / 100
         self.a = 2  # see Huff et al 2011 supplemental material
         self.first_deg_adj = first_deg_adj
         self.avuncular_adj = avuncular_adj
+        self._d_vectors = {}
 
     def _Fa(self, i, d, k_max=200):
         assert i >= self.t
@@ -206,20 +273,7 @@ class Relation(Background):
             # l_a1 = k * log(1/2) + (k-1) * log(l) -
             #        (d * l) / 100 - k * log(100/d) - log(factorial(k - 1))
             l_a1 = log(1/2) - (d * i) / 100 - log(100/d)
-
-            sum = 0
-            for k in range(2, k_max + 1):
-                # Todo speed improvement
-                # l_ai = k * log(1/2) + (k-1) * log(l) - (d * l) / 100
-                #      - k * log(100/d) - log(factorial(k - 1))
-                diff = (k - 1) * log(i / 100)
-                term = 0
-                for j in range(2, k):
-                    term += log(j)
-                diff -= term
-                sum += exp(diff)
-            y = log1p(sum)
-            l_prob = l_a1 + y
+            l_prob = l_a1 + _first_deg_series(i, k_max)
         else:
             l_prob = (-d * (i - self.t) / 100)
             l_prob += -log(100 / d)
@@ -244,7 +298,7 @@ class Relation(Background):
             lambda_ = (3/4) * self.c + 4 * self.r * ((3/4) * (1/4))
         else:
             lambda_ = (self.a * (self.r * d + self.c) * self._p(d)) / (2 ** (d - 1))
-        l_prob = n * log(lambda_) - lambda_ - log(factorial(n))
+        l_prob = n * log(lambda_) - lambda_ - _log_factorial(n)
         return l_prob
 
     def _LLr(self, np, na, s, d):
@@ -284,22 +338,184 @@ class Relation(Background):
         max_np, max_mll : (int, float)
            number of segments attributed to background, log-likelihood
         """
+        sp = [0]
+        for i in s:
+            sp.append(sp[-1] + self._Fp(i))
+        fa = [self._Fa(i, d) for i in s]
+        sa = [0] * (len(s) + 1)
+        for k in range(len(s) - 1, -1, -1):
+            sa[k] = fa[k] + sa[k + 1]
+
+        # sp[k] equals _Sp(s[:k]) exactly, while the suffix sums sa[k]
+        # add the terms of _Sa(s[k:]) in reverse order and can differ
+        # from it in the last bits; every np within tol of the best
+        # approximate value is evaluated again in the original order.
+        approx = []
+        for np in range(n + 1):
+            k = min(np, len(s))
+            approx.append(self._Np(np) + self._Na(n - np, d) + sp[k] + sa[k])
+        tol = 1e-9 * (1 + sum(abs(x) for x in fa))
+        best = max(approx)
+
         max_mll, max_np = None, None
         for np in range(n + 1):
-            mll = self._LLr(np, n - np, s, d)
+            if approx[np] < best - tol:
+                continue
+            k = min(np, len(s))
+            mll = 0
+            mll += self._Np(np)
+            mll += self._Na(n - np, d)
+            mll += sp[k]
+            sa_k = 0
+            for x in fa[k:]:
+                sa_k += x
+            mll += sa_k
             if max_mll is None:
                 max_mll, max_np = mll, np
             elif max_mll < mll:
                 max_mll, max_np = mll, np
         return max_np, max_mll
 
+    def _d_constants(self, max_d):
+        """
+        Returns the per-d constants used by _LLr_matrix() for
+        d = 1, ..., max_d as arrays (d, lambda_, log(lambda_), log(100 / d)),
+        where lambda_ is the mean of Na.  Each entry is computed with the
+        same scalar operations as _Na() and _Fa(), and the arrays are
+        kept for later calls with the same max_d and adjustments.
+        """
+        key = (max_d, self.first_deg_adj, self.avuncular_adj)
+        if key not in self._d_vectors:
+            lambdas = []
+            for d in range(1, max_d + 1):
+                if self.first_deg_adj and d == 2:
+                    lambda_ = (3/4) * self.c + 2 * d * self.r * (3/4) * (1/4)
+                elif self.avuncular_adj and d == 3:
+                    lambda_ = (3/4) * self.c + 4 * self.r * ((3/4) * (1/4))
+                else:
+                    lambda_ = (self.a * (self.r * d + self.c) * self._p(d)) / (2 ** (d - 1))
+                lambdas.append(lambda_)
+            self._d_vectors[key] = (np.arange(1, max_d + 1, dtype=float),
+                                    np.array(lambdas),
+                                    np.array([log(x) for x in lambdas]),
+                                    np.array([log(100 / d) for d in range(1, max_d + 1)]))
+        return self._d_vectors[key]
+
+    def _N_matrix(self, n, max_d):
+        """
+        Returns the (max_d, n + 1) array of _Np(np) + _Na(n - np, d)
+        for d = 1, ..., max_d and np = 0, ..., n.
+        """
+        _, lambda_a, log_lambda_a, _ = self._d_constants(max_d)
+        log_fact = _log_factorials(n)
+        nps = np.arange(n + 1, dtype=float)
+        l_np = nps * log(self.lambda_) - self.lambda_ - log_fact
+        l_na = nps[::-1] * log_lambda_a[:, None] - lambda_a[:, None] - log_fact[::-1]
+        return l_np + l_na
+
+    def _Fa_matrix(self, s, max_d):
+        """
+        Returns the (max_d, len(s)) array of _Fa(s[j], d) for
+        d = 1, ..., max_d.
+        """
+        s = np.asarray(s, dtype=float)
+        assert not len(s) or s.min() >= self.t
+        d, _, _, log_100_d = self._d_constants(max_d)
+        fa = (-d[:, None] * (s - self.t)) / 100
+        fa -= log_100_d[:, None]
+        if self.first_deg_adj and max_d >= 2:
+            values, inverse = np.unique(s, return_inverse=True)
+            series = np.array([_first_deg_series(i) for i in values.tolist()])
+            fa[1] = (log(1/2) - (2 * s) / 100 - log(100/2)) + series[inverse]
+        return fa
+
+    def _LLr_matrix(self, n, s, max_d):
+        """
+        Compute Lr for every d = 1, ..., max_d and np = 0, ..., n at once.
+
+        Requires s to be pre-sorted from smallest to largest.
+
+        Returns
+        -------
+        LLr, base, fa : (numpy.ndarray[float], numpy.ndarray[float], numpy.ndarray[float])
+            LLr[d - 1, np] approximates _LLr(np, n - np, s, d); the ancestral
+            segment terms are summed from the longest segment down, so
+            entries can differ from _LLr() in the last bits.  base[d - 1, np]
+            is _LLr() without the ancestral segment terms, which are given
+            by fa (see _Fa_matrix()).
+        """
+        s = np.asarray(s, dtype=float)
+        k = np.minimum(np.arange(n + 1), len(s))
+        fp = -(s - self.t) / self.theta - log(self.theta)
+        sp = np.concatenate(([0.0], np.cumsum(fp)))
+        base = self._N_matrix(n, max_d) + sp[k]
+
+        fa = self._Fa_matrix(s, max_d)
+        sa = np.zeros((max_d, len(s) + 1))
+        sa[:, :-1] = np.cumsum(fa[:, ::-1], axis=1)[:, ::-1]
+        return base + sa[:, k], base, fa
+
+    def MLL_all(self, n, s, max_d):
+        """
+        Return the result of MLL(n, s, d) for each d = 1, ..., max_d,
+        computed from one log-likelihood matrix over all d and np.
+        Requires s to be sorted smallest to largest.
+
+        Parameters
+        ----------
+        n : int
+            number of shared segments
+
+        s : list[float]
+            list of segment lengths (in cM)
+
+        max_d : int
+            maximum combined number of generations to evaluate
+
+        Returns
+        -------
+        alts : list[(int, int, float)]
+            (d, max_np, max_mll) for d = 1, ..., max_d
+        """
+        LLr, base, fa = self._LLr_matrix(n, s, max_d)
+        k = np.minimum(np.arange(n + 1), len(s))
+
+        # As in MLL(), every np within tol of the best approximate value
+        # is evaluated again with the ancestral terms summed in order.
+        tol = 1e-9 * (1 + np.abs(fa).sum(axis=1))
+        best = LLr.max(axis=1)
+        alts = []
+        for d in range(1, max_d + 1):
+            max_mll, max_np = None, None
+            for np_ in np.flatnonzero(LLr[d - 1] >= best[d - 1] - tol[d - 1]).tolist():
+                sa_k = fa[d - 1, k[np_]:]
+                mll = float(base[d - 1, np_])
+                if len(sa_k):
+                    mll += float(np.cumsum(sa_k)[-1])
+                if max_mll is None or max_mll < mll:
+                    max_mll, max_np = mll, np_
+            alts.append((d, max_np, max_mll))
+        return alts
+
+
+@lru_cache(maxsize=None)
+def rel_estimate(d):
+    """
+    Returns the rel_est of an Estimate of d combined generations for
+    individuals with unknown years of birth, see potential_relationship()
+    """
+    years = (0, 0) if d % 2 == 0 else (0, 31)
+    return potential_relationship(d, None, None, years[0], years[1])
+
 
 class Estimate:
     """
     Structure to hold results from estimate_relation
     """
     def __init__(self, pair, dob, d, reject, null_LL, max_LL, lower_d, upper_d, alts, s, np):
-        self.indv1, self.indv2 = pair.split(':')
+        if isinstance(pair, str):
+            pair = pair.split(':')
+        self.indv1, self.indv2 = pair
         self.dob = dob
         self.reject = reject
         self.alts = alts
@@ -310,13 +526,10 @@ class Estimate:
         self.upper_d = upper_d
         self.np = np
         if reject:
-            years = [dob[0], dob[1]]
             if dob[0] is None or dob[1] is None:
-                if d % 2 == 0:
-                    years[0], years[1] = 0, 0
-                else:
-                    years[0], years[1] = 0, 31
-            self.rel_est = potential_relationship(d, self.indv1, self.indv2, years[0], years[1])
+                self.rel_est = rel_estimate(d)
+            else:
+                self.rel_est = potential_relationship(d, self.indv1, self.indv2, dob[0], dob[1])
         else:
             self.rel_est = None
         # "collapse" d from number of meiosis to
@@ -325,7 +538,7 @@ class Estimate:
         # the new d becomes 0, which in reality should
         # still be d = 1 since the algorithm
         # does not test for MZ twins.
-        self.d = d - 1
+        self.d = d - 1 if d is not None else None
         self.cm = sum(s)
 
 
@@ -336,9 +549,9 @@ def estimate_relation(pair, dob, n, s, h0, ha, max_d, alpha, ci=False):
 
     Parameters
     ----------
-    pair : str
+    pair : str | (str, str)
         Identifier for pair of individuals being tested in the format
-        "indv1:indv2"
+        "indv1:indv2", or the tuple (indv1, indv2)
 
     dob : (int, int) | (None, None)
         Tuple for years of birth for (indv1, indv2)
@@ -374,10 +587,7 @@ def estimate_relation(pair, dob, n, s, h0, ha, max_d, alpha, ci=False):
 
     null_LL = h0.LL(n, s)
 
-    alts = []
-    for d in range(1, max_d + 1):
-        alt_np, alt_MLL = ha.MLL(n, s, d)
-        alts.append((d, alt_np, alt_MLL))
+    alts = ha.MLL_all(n, s, max_d)
     max_alt = max(alts, key=itemgetter(2))
     d, np, max_LL = max_alt[0], max_alt[1], max_alt[2]
     reject = LL_ratio_test(max_LL, null_LL, alpha)
@@ -389,6 +599,370 @@ def estimate_relation(pair, dob, n, s, h0, ha, max_d, alpha, ci=False):
     return est
 
 
+class Estimates:
+    """
+    Columnar results of estimate_relations() for a batch of pairs,
+    with one array element (or row) per pair.  As in the alts of
+    estimate_relation(), d is the combined number of generations,
+    not the relationship degree of Estimate.d.
+
+    Attributes
+    ----------
+    n : numpy.ndarray[int]
+        number of shared segments
+
+    cm : numpy.ndarray[float]
+        total length of shared segments (in cM)
+
+    null_LL, max_LL : numpy.ndarray[float]
+
+    d, np : numpy.ndarray[int]
+        d and np of the maximum alternative
+
+    reject : numpy.ndarray[bool]
+
+    lower_d, upper_d : numpy.ndarray[int]
+        confidence interval for d, 0 where it was not computed
+
+    alt_np, alt_LL : numpy.ndarray[int], numpy.ndarray[float]
+        alt_np[i, d - 1] and alt_LL[i, d - 1] are the results of
+        Relation.MLL() for the i-th pair and d
+
+    pruned : numpy.ndarray[bool]
+        pairs shown not to be significant by a CriticalTable, for which
+        no alternative was evaluated; their max_LL and alt_LL are nan
+        and their d, np and alt_np are 0
+    """
+    def __init__(self, n, cm, null_LL, max_LL, d, np, reject, lower_d, upper_d, alt_np, alt_LL, pruned):
+        self.n = n
+        self.cm = cm
+        self.null_LL = null_LL
+        self.max_LL = max_LL
+        self.d = d
+        self.np = np
+        self.reject = reject
+        self.lower_d = lower_d
+        self.upper_d = upper_d
+        self.alt_np = alt_np
+        self.alt_LL = alt_LL
+        self.pruned = pruned
+
+    def __len__(self):
+        return len(self.n)
+
+    def estimate(self, i, pair, dob, s):
+        """
+        Returns the Estimate of the i-th pair, equal to the result of
+        estimate_relation() for it.  The Estimate of a pruned pair
+        has no alts, and its d, np and max_LL are None.
+
+        Parameters
+        ----------
+        i : int
+
+        pair : str | (str, str)
+
+        dob : (int, int) | (None, None)
+
+        s : list[float]
+            the segment lengths of the pair
+        """
+        if self.pruned[i]:
+            return Estimate(pair, dob, None, False, float(self.null_LL[i]), None, None, None, [], s, None)
+        alts = [(d, alt_np, alt_LL) for d, (alt_np, alt_LL)
+                in enumerate(zip(self.alt_np[i].tolist(), self.alt_LL[i].tolist()), 1)]
+        lower_d = int(self.lower_d[i]) or None
+        upper_d = int(self.upper_d[i]) or None
+        return Estimate(pair, dob, int(self.d[i]), bool(self.reject[i]), float(self.null_LL[i]),
+                        float(self.max_LL[i]), lower_d, upper_d, alts, s, int(self.np[i]))
+
+
+"""
+_BATCH_ELEMENTS : int
+    maximum number of (pair, d, np) likelihoods that
+    estimate_relations() evaluates at once
+"""
+_BATCH_ELEMENTS = 2 ** 20
+
+
+def _Sp_prefixes(S, h0):
+    """
+    Returns the array of h0._Sp(S[i, :k]) for every row i of S and
+    k = 0, ..., S.shape[1].
+    """
+    fp = -(S - h0.t) / h0.theta - log(h0.theta)
+    sp = np.zeros((S.shape[0], S.shape[1] + 1))
+    np.cumsum(fp, axis=1, out=sp[:, 1:])
+    return sp
+
+
+def _estimate_group(S, h0, ha, max_d):
+    """
+    Evaluates the null and all alternatives for the pairs with
+    the rows of S as their sorted segment lengths.
+
+    Returns
+    -------
+    null_LL, alt_np, alt_LL : (numpy.ndarray[float], numpy.ndarray[int], numpy.ndarray[float])
+    """
+    m, n = S.shape
+    sp = _Sp_prefixes(S, h0)
+    null_LL = h0._Np(n) + sp[:, n]
+
+    base = ha._N_matrix(n, max_d)[None, :, :] + sp[:, None, :]
+    fa = ha._Fa_matrix(S.ravel(), max_d).reshape(max_d, m, n).transpose(1, 0, 2)
+    sa = np.zeros((m, max_d, n + 1))
+    sa[:, :, :-1] = np.cumsum(fa[:, :, ::-1], axis=2)[:, :, ::-1]
+    LLr = base + sa
+
+    # As in Relation.MLL_all(), the ancestral terms of every np within
+    # tol of the best approximate value are summed again in order.
+    tol = 1e-9 * (1 + np.abs(fa).sum(axis=2))
+    i, d, k = np.nonzero(LLr >= (LLr.max(axis=2) - tol)[:, :, None])
+    sa_k = np.zeros(len(k))
+    for j in range(n):
+        sa_k += np.where(k <= j, fa[i, d, j], 0.0)
+    exact = np.full(LLr.shape, -np.inf)
+    exact[i, d, k] = base[i, d, k] + sa_k
+    return null_LL, exact.argmax(axis=2), exact.max(axis=2)
+
+
+class EstimateCache:
+    """
+    Bounded least recently used cache of the likelihoods computed by
+    estimate_relations(), keyed by the model parameters and the exact
+    sorted segment lengths of a pair, so that pairs sharing the same
+    segment length profile are only evaluated once.  d, np, reject and
+    the confidence interval follow from the cached likelihoods.
+
+    Parameters
+    ----------
+    maxsize : int
+        maximum number of segment length profiles kept
+
+    Attributes
+    ----------
+    hits : int
+        number of pairs whose likelihoods were reused
+
+    misses : int
+        number of pairs whose likelihoods were computed
+    """
+    def __init__(self, maxsize=2 ** 16):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def estimate_group(self, S, h0, ha, max_d):
+        """
+        Returns the result of _estimate_group(S, h0, ha, max_d),
+        computing only the rows of S that are not cached.
+        """
+        model = (h0.t, h0.theta, h0.lambda_, ha.c, ha.r, ha.t, ha.theta, ha.lambda_, ha.a,
+                 ha.first_deg_adj, ha.avuncular_adj, max_d)
+        rows, inverse = np.unique(S, axis=0, return_inverse=True)
+        keys = [(model, row) for row in map(tuple, rows.tolist())]
+        found = [self._entries.get(key) for key in keys]
+        missing = [j for j, entry in enumerate(found) if entry is None]
+        for key, entry in zip(keys, found):
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if missing:
+            null_LL, alt_np, alt_LL = _estimate_group(rows[missing], h0, ha, max_d)
+            for i, j in enumerate(missing):
+                found[j] = (null_LL[i], alt_np[i], alt_LL[i])
+                self._entries[keys[j]] = found[j]
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        self.misses += len(missing)
+        self.hits += len(S) - len(missing)
+
+        inverse = inverse.reshape(-1)
+        null_LL = np.array([entry[0] for entry in found])
+        alt_np = np.array([entry[1] for entry in found]).reshape(len(found), max_d)
+        alt_LL = np.array([entry[2] for entry in found]).reshape(len(found), max_d)
+        return null_LL[inverse], alt_np[inverse], alt_LL[inverse]
+
+
+class CriticalTable:
+    """
+    Table of critical total segment lengths by number of segments,
+    below which a pair cannot reject the null hypothesis.
+
+    For a pair with n segments s and X = sum(s) - n * t, every
+    alternative satisfies
+
+        Lr(np, d) - Lp <= Np(np) - Np(n) + Na(n - np, d)
+                          + na * c(d) + max(b(d), 0) * X     (na > 0)
+
+    where Fa(i | d) - Fp(i) <= c(d) + b(d) * (i - t) for all i >= t
+    (equal for the unadjusted Fa, and using log1p(series) <= i / 100 for
+    the first-degree adjustment).  The right hand side is increasing in
+    X, so the smallest X at which it can reach the critical value of the
+    likelihood ratio test is a threshold for each n; pairs below it are
+    not significant.  A margin on the critical value absorbs rounding,
+    so a pair is never pruned when estimate_relation() would reject.
+
+    Parameters
+    ----------
+    h0 : Background
+
+    ha : Relation
+
+    max_d : int
+        Maximum d to test
+
+    alpha : float
+        Significance level for likelihood ratio test
+
+    Attributes
+    ----------
+    pruned : int
+        number of pairs pruned by prune()
+    """
+    def __init__(self, h0, ha, max_d, alpha):
+        self.h0 = h0
+        self.ha = ha
+        self.max_d = max_d
+        self.pruned = 0
+        self._thresholds = {}
+        ratio = chi2.ppf(1 - alpha, 2)
+        while ratio > 0 and not 1 - chi2.cdf(ratio, 2) >= alpha:
+            ratio *= 1 - 1e-9
+        self._max_LL_ratio = ratio / 2 if 1 - chi2.cdf(ratio, 2) >= alpha else None
+
+        d = np.arange(1, max_d + 1, dtype=float)
+        self._c = np.log(d * h0.theta / 100) + d * (ha.t - h0.t) / 100
+        self._b = 1 / h0.theta - d / 100
+        if ha.first_deg_adj and max_d >= 2:
+            self._c[1] = log(h0.theta / 100) - h0.t / 100
+            self._b[1] = 1 / h0.theta - 1 / 100
+
+    def threshold(self, n):
+        """
+        Returns the critical X = sum(s) - n * t for pairs with n
+        segments; pairs with smaller X cannot reject H0.
+        """
+        if n not in self._thresholds:
+            self._thresholds[n] = float(self._threshold(n))
+        return self._thresholds[n]
+
+    def _threshold(self, n):
+        if self._max_LL_ratio is None:
+            return -np.inf
+        na = np.arange(n, -1, -1)
+        K = self.ha._N_matrix(n, self.max_d) - self.h0._Np(n) + na * self._c[:, None]
+        b = np.where(na > 0, np.maximum(self._b, 0)[:, None], 0)
+        target = self._max_LL_ratio - 1e-6 * (1 + np.abs(K).max())
+        with np.errstate(divide='ignore'):
+            X = np.where(K >= target, 0, np.where(b > 0, (target - K) / b, np.inf))
+        return X.min()
+
+    def prune(self, S):
+        """
+        Returns True for the rows of S (sorted segment lengths of
+        pairs with S.shape[1] segments) that cannot reject H0.
+        """
+        n = S.shape[1]
+        X = S.sum(axis=1) - n * self.h0.t
+        skip = X < self.threshold(n)
+        self.pruned += int(np.count_nonzero(skip))
+        return skip
+
+
+def estimate_relations(lengths, offsets, h0, ha, max_d, alpha, ci=False, cache=None, prune=None):
+    """
+    Tests a batch of pairs of individuals for a relation, with the
+    same results as calling estimate_relation() for each pair.  The
+    segments of the i-th pair are lengths[offsets[i]:offsets[i + 1]],
+    sorted from smallest to largest.
+
+    Pairs are grouped by their number of segments and the
+    likelihoods of each group are computed as arrays.
+
+    Parameters
+    ----------
+    lengths : numpy.ndarray[float]
+        shared segment lengths of all pairs
+
+    offsets : numpy.ndarray[int]
+        len(offsets) is the number of pairs + 1
+
+    h0 : Background
+
+    ha : Relation
+
+    max_d : int
+        Maximum d to test
+
+    alpha : float
+        Significance level for likelihood ratio test
+
+    ci : bool
+        Controls whether confidence intervals are calculated
+
+    cache : EstimateCache | None
+        reuses the likelihoods of segment length profiles
+        evaluated before
+
+    prune : CriticalTable | None
+        skips the alternatives of pairs that cannot reject H0,
+        see Estimates.pruned
+
+    Returns
+    -------
+    ests : Estimates
+    """
+    assert isinstance(h0, Background)
+    assert isinstance(ha, Relation)
+    lengths = np.asarray(lengths, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+    n_pairs = len(counts)
+    pair_of_row = np.repeat(np.arange(n_pairs), counts)
+    assert ((np.diff(lengths) >= 0) | (np.diff(pair_of_row) != 0)).all()
+
+    cm = np.zeros(n_pairs)
+    null_LL = np.empty(n_pairs)
+    alt_np = np.zeros((n_pairs, max_d), dtype=np.int64)
+    alt_LL = np.full((n_pairs, max_d), np.nan)
+    pruned = np.zeros(n_pairs, dtype=bool)
+    for n in np.unique(counts).tolist():
+        pairs = np.flatnonzero(counts == n)
+        rows = max(1, _BATCH_ELEMENTS // (max_d * (n + 1)))
+        for start in range(0, len(pairs), rows):
+            group = pairs[start:start + rows]
+            S = lengths[offsets[group][:, None] + np.arange(n)]
+            if n:
+                cm[group] = np.cumsum(S, axis=1)[:, -1]
+            if prune is not None:
+                skip = prune.prune(S)
+                pruned[group[skip]] = True
+                null_LL[group[skip]] = h0._Np(n) + _Sp_prefixes(S[skip], h0)[:, n]
+                group, S = group[~skip], S[~skip]
+                if not len(group):
+                    continue
+            if cache is None:
+                null_LL[group], alt_np[group], alt_LL[group] = _estimate_group(S, h0, ha, max_d)
+            else:
+                null_LL[group], alt_np[group], alt_LL[group] = cache.estimate_group(S, h0, ha, max_d)
+
+    best = np.where(pruned, 0, np.nan_to_num(alt_LL, nan=-np.inf).argmax(axis=1))
+    pick = np.arange(n_pairs)
+    max_LL = alt_LL[pick, best]
+    reject = LL_ratio_tests(max_LL, null_LL, alpha) & ~pruned
+    lower_d = np.zeros(n_pairs, dtype=np.int64)
+    upper_d = np.zeros(n_pairs, dtype=np.int64)
+    if ci and reject.any():
+        lower_d[reject], upper_d[reject] = likelihood_ratio_CIs(alt_LL[reject], max_LL[reject], alpha)
+    return Estimates(counts, cm, null_LL, max_LL, np.where(pruned, 0, best + 1), alt_np[pick, best],
+                     reject, lower_d, upper_d, alt_np, alt_LL, pruned)
+
+
 def _static_vars(**kwargs):
     """
     Decorator for adding static variables to functions.
@@ -0,0 +1,279 @@
+""" Index of matchfile rows by individual for reading one user's pairs """
+#   Copyright (c) 2015 by
+#   Richard Munoz <rmunoz@nygenome.org>
+#   Jie Yuan <jyuan@nygenome.org>
+#   Yaniv Erlich <yaniv@nygenome.org>
+#
+#   All rights reserved
+#   GPL license
+
+from ersa.parser import is_plain_file, _BLOCK_SIZE, _Interner, _iter_blocks, _parse_block
+from ersa.cache import read_arrays, write_arrays
+import numpy as np
+import os
+
+
+"""
+_INDEX_VERSION : int
+    bumped whenever the layout of index files changes
+"""
+_INDEX_VERSION = 2
+
+
+"""
+_WHITESPACE : numpy.ndarray[bool]
+    True for the byte values that bytes.split() treats as whitespace
+"""
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[list(b" \t\n\r\x0b\x0c")] = True
+
+
+class MatchIndex:
+    """
+    Byte ranges of the lines of a matchfile that involve each
+    individual, so that the lines of one individual can be read
+    without scanning the whole file.
+
+    Parameters
+    ----------
+    names : numpy.ndarray[str]
+        sorted individual identifiers, memory mapped when loaded by
+        load_index(), so that a lookup does not depend on the number
+        of individuals in the cohort
+
+    offsets : numpy.ndarray[int64]
+        the ranges of names[i] are ranges[offsets[i]:offsets[i + 1]]
+
+    ranges : numpy.ndarray[int64]
+        (start, end) byte offsets of runs of consecutive lines,
+        sorted by start for each individual
+
+    file_size : int
+        size of the indexed matchfile (in bytes)
+
+    file_mtime : int
+        modification time of the indexed matchfile (in ns)
+    """
+    def __init__(self, names, offsets, ranges, file_size, file_mtime):
+        self.names = names
+        self.offsets = offsets
+        self.ranges = ranges
+        self.file_size = file_size
+        self.file_mtime = file_mtime
+
+    def codes(self, users):
+        """
+        Returns the positions in names of those of users that
+        were indexed, looked up by binary search.
+
+        Parameters
+        ----------
+        users : list[str]
+
+        Returns
+        -------
+        codes : numpy.ndarray[int64]
+        """
+        users = np.array(users, dtype=str)
+        if not len(self.names) or not len(users):
+            return np.empty(0, dtype=np.int64)
+        codes = np.searchsorted(self.names, users)
+        inside = codes < len(self.names)
+        codes, users = codes[inside], users[inside]
+        return codes[self.names[codes] == users].astype(np.int64)
+
+    def is_current(self, path):
+        """ Returns True if the matchfile at path has not changed since indexing """
+        st = os.stat(path)
+        return st.st_size == self.file_size and st.st_mtime_ns == self.file_mtime
+
+    def ranges_for(self, user):
+        """
+        Returns the byte ranges of all lines involving user.
+
+        Parameters
+        ----------
+        user : str | iterable[str]
+            one individual identifier or a collection of them
+
+        Returns
+        -------
+        ranges : numpy.ndarray[int64]
+            array of shape (n, 2) with sorted, non-overlapping
+            (start, end) byte offsets
+        """
+        users = [user] if isinstance(user, str) else sorted(set(user))
+        codes = self.codes(users).tolist()
+        if not codes:
+            return np.empty((0, 2), dtype=np.int64)
+        if len(codes) == 1:
+            return self.ranges[self.offsets[codes[0]]:self.offsets[codes[0] + 1]]
+        return _merge_ranges(np.concatenate([self.ranges[self.offsets[c]:self.offsets[c + 1]]
+                                             for c in codes]))
+
+    def read_columns(self, path, user, haploscores=False, block_size=_BLOCK_SIZE):
+        """
+        Reads only the lines of the matchfile at path that involve user.
+
+        Parameters
+        ----------
+        path : str
+
+        user : str | iterable[str]
+            one individual identifier or a collection of them
+
+        haploscores : bool
+            True if the input matchfile contains haploscores in an
+            extra column at the end of each line.
+
+        block_size : int
+            approximate number of bytes parsed at a time
+
+        Returns
+        -------
+        cols : generator[MatchColumns]
+            see parser.read_matchfile_columns()
+        """
+        interner = _Interner()
+        with open(path, "rb") as matchfile:
+            parts, n_read = [], 0
+            for start, end in self.ranges_for(user).tolist():
+                matchfile.seek(start)
+                parts.append(matchfile.read(end - start))
+                n_read += end - start
+                if n_read >= block_size:
+                    yield _parse_block(b"\n".join(parts), haploscores, interner)
+                    parts, n_read = [], 0
+            if parts:
+                yield _parse_block(b"\n".join(parts), haploscores, interner)
+
+
+def index_path(path):
+    """ Returns the path of the sidecar index file for the matchfile at path """
+    return path + ".ersaidx"
+
+
+def _line_ranges(block, base):
+    """
+    Returns the (start, end) byte offsets of the non-blank lines in
+    block, where block starts at offset base in the file and end
+    includes the line break.
+    """
+    buf = np.frombuffer(block, dtype=np.uint8)
+    breaks = np.flatnonzero((buf == ord("\n")) | (buf == ord("\r")))
+    starts = np.concatenate(([0], breaks + 1))
+    ends = np.concatenate((breaks + 1, [len(buf)]))
+    n_text = np.concatenate(([0], np.cumsum(~_WHITESPACE[buf])))
+    nonblank = n_text[ends] > n_text[starts]
+    return starts[nonblank] + base, ends[nonblank] + base
+
+
+def _coalesce(codes, starts, ends):
+    """
+    Sorts (code, start, end) line entries by code and start and merges
+    runs of consecutive lines of the same code into single ranges.
+    """
+    if len(codes) == 0:
+        return codes, starts, ends
+    order = np.lexsort((starts, codes))
+    codes, starts, ends = codes[order], starts[order], ends[order]
+    new_run = np.ones(len(codes), dtype=bool)
+    new_run[1:] = (codes[1:] != codes[:-1]) | (starts[1:] > ends[:-1])
+    run_ends = np.append(np.flatnonzero(new_run)[1:] - 1, len(codes) - 1)
+    return codes[new_run], starts[new_run], ends[run_ends]
+
+
+def _merge_ranges(ranges):
+    """
+    Sorts an array of (start, end) ranges and merges the ones that
+    overlap or touch, so that no byte is covered twice.
+    """
+    if len(ranges) == 0:
+        return ranges
+    ranges = ranges[np.argsort(ranges[:, 0], kind="stable")]
+    ends = np.maximum.accumulate(ranges[:, 1])
+    new_run = np.ones(len(ranges), dtype=bool)
+    new_run[1:] = ranges[1:, 0] > ends[:-1]
+    run_ends = np.append(np.flatnonzero(new_run)[1:] - 1, len(ranges) - 1)
+    return np.column_stack((ranges[new_run, 0], ends[run_ends]))
+
+
+def build_index(path, haploscores=False, block_size=_BLOCK_SIZE):
+    """
+    Scans the matchfile at path once and builds a MatchIndex of it.
+
+    Parameters
+    ----------
+    path : str
+        uncompressed matchfile, see parser.is_plain_file()
+
+    haploscores : bool
+        True if the input matchfile contains haploscores in an
+        extra column at the end of each line.
+
+    block_size : int
+
+    Returns
+    -------
+    index : MatchIndex
+    """
+    if not is_plain_file(path):
+        raise ValueError("only uncompressed matchfiles can be indexed")
+    st = os.stat(path)
+    interner = _Interner()
+    entries = []
+    base = 0
+    with open(path, "rb") as matchfile:
+        for block in _iter_blocks(matchfile, block_size):
+            cols = _parse_block(block, haploscores, interner)
+            starts, ends = _line_ranges(block, base)
+            assert len(starts) == len(cols)
+            base += len(block)
+            entries.append(_coalesce(np.concatenate((cols.indv1, cols.indv2)),
+                                     np.concatenate((starts, starts)),
+                                     np.concatenate((ends, ends))))
+
+    # renumber individuals in the order of their sorted names
+    names = np.array(interner.names, dtype=str)
+    order = np.argsort(names, kind="stable")
+    rank = np.empty(len(names), dtype=np.int64)
+    rank[order] = np.arange(len(names))
+    if entries:
+        codes, starts, ends = [np.concatenate(e) for e in zip(*entries)]
+        codes, starts, ends = _coalesce(rank[codes], starts, ends)
+    else:
+        codes, starts, ends = np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int64)
+    offsets = np.searchsorted(codes, np.arange(len(names) + 1))
+    ranges = np.column_stack((starts, ends)).astype(np.int64)
+    return MatchIndex(names[order], offsets.astype(np.int64), ranges,
+                      st.st_size, st.st_mtime_ns)
+
+
+def save_index(path, index):
+    """ Writes index to the file at path """
+    write_arrays(path, [np.array([_INDEX_VERSION, index.file_size, index.file_mtime],
+                                 dtype=np.int64),
+                        np.asarray(index.names, dtype=str),
+                        index.offsets, index.ranges])
+
+
+def load_index(path):
+    """
+    Reads an index file written by save_index().
+
+    Returns
+    -------
+    index : MatchIndex | None
+        None if there is no index file, it cannot be read or it has
+        an older layout
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        header, names, offsets, ranges = read_arrays(path)
+    except (OSError, ValueError):
+        return None     # e.g. no read permission, scan the matchfile instead
+    if header[0] != _INDEX_VERSION:
+        return None
+    return MatchIndex(names, offsets, ranges.reshape(-1, 2),
+                      int(header[1]), int(header[2]))
@@ -9,6 +9,8 @@ Genomic Region Masking
 #   All rights reserved
 #   GPL license
 
+import numpy as np
+
 
 """
 b : int
@@ -40,6 +42,40 @@ masked[16].append((19393068, 24031556, 6.18))
 masked[2].append((192352906, 198110229, 5.04))
 
 
+def _mask_segment(chrom, bp_start, bp_end, length):
+    """
+    Applies the masked regions of chrom to one segment.
+
+    Returns
+    -------
+    bp_start, bp_end, length : (int, int, float)
+        the segment after masking, where length is 0 if
+        the segment is entirely masked
+    """
+    for r in masked[chrom]:
+        l = r[0]  # low
+        h = r[1]  # high
+        mask_cm = r[2]
+        # todo check if l - b or h + b fall off a chromosome?
+        if bp_start > l - b and bp_end < h + b:
+            return bp_start, bp_end, 0
+        elif bp_start <= l - b and bp_end >= h + b:
+            # subtract len but keep start & end
+            # for visual display
+            return bp_start, bp_end, length - mask_cm
+        elif l <= bp_start <= h < bp_end:
+            # truncate, changing start
+            # for the visual display
+            ratio = (bp_end - h) / (bp_end - bp_start)
+            return h, bp_end, round(length * ratio, 2)
+        elif h >= bp_end >= l > bp_start:
+            # truncate, changing end
+            # for the visual display
+            ratio = (l - bp_start) / (bp_end - bp_start)
+            return bp_start, l, round(length * ratio, 2)
+    return bp_start, bp_end, length
+
+
 def mask_input_segs(segs, t):
     """
     Modifies input segment lengths that fall into
@@ -61,50 +97,206 @@ def mask_input_segs(segs, t):
     """
     new_segs = []
     for s in segs:
-        regions = masked[s.chrom]
-        for r in regions:
-            l = r[0]  # low
-            h = r[1]  # high
-            mask_cm = r[2]
-            # todo check if l - b or h + b fall off a chromosome?
-            if s.bpStart > l - b and s.bpEnd < h + b:
-                s.length = 0
-                break
-            elif s.bpStart <= l - b and s.bpEnd >= h + b:
-                # subtract len but keep start & end
-                # for visual display
-                s.length -= mask_cm
-                break
-            elif l <= s.bpStart <= h < s.bpEnd:
-                # truncate, changing start
-                # for the visual display
-                ratio = (s.bpEnd - h) / (s.bpEnd - s.bpStart)
-                s.length *= ratio
-                s.length = round(s.length, 2)
-                s.bpStart = h
-                break
-            elif h >= s.bpEnd >= l > s.bpStart:
-                # truncate, changing end
-                # for the visual display
-                ratio = (l - s.bpStart) / (s.bpEnd - s.bpStart)
-                s.length *= ratio
-                s.length = round(s.length, 2)
-                s.bpEnd = l
-                break
+        s.bpStart, s.bpEnd, s.length = _mask_segment(s.chrom, s.bpStart, s.bpEnd, s.length)
         if s.length >= t:
             new_segs.append(s)
 
     return new_segs
 
 
-def total_masked():
+class Mask:
+    """
+    Genomic regions to mask, indexed by chromosome so that whole
+    arrays of segments can be masked at once.  A segment is masked
+    as in mask_input_segs() by the first listed region of its
+    chromosome that it overlaps or lies close to.
+
+    Parameters
+    ----------
+    regions : iterable[(int, int, int, float)]
+        (chrom, low, high, length in cM) of each region
+
+    flank : int
+        regions must extend this far beyond each end of a
+        masked region, see b
+    """
+    def __init__(self, regions, flank=b):
+        self.regions = [(int(c), int(l), int(h), float(cm)) for c, l, h, cm in regions]
+        self.flank = flank
+        by_chrom = {}
+        for priority, (c, l, h, cm) in enumerate(self.regions):
+            by_chrom.setdefault(c, []).append((l - flank, h + flank, l, h, cm, priority))
+        self._index = {}
+        for c, rows in by_chrom.items():
+            rows.sort()
+            window_start, window_end, low, high, mask_cm, priority = \
+                [np.array(col) for col in zip(*rows)]
+            # windows sorted by start, with the furthest end so far, so
+            # that the windows near a segment form a contiguous range
+            self._index[c] = (window_start, np.maximum.accumulate(window_end),
+                              low, high, mask_cm, priority)
+
+    def total(self):
+        """ Returns the sum of the lengths of the regions in cM """
+        m = 0
+        for r in self.regions:
+            m += r[3]
+        return m
+
+    def apply(self, chrom, bp_start, bp_end, length):
+        """
+        See mask_columns().
+        """
+        new_start, new_end = bp_start.copy(), bp_end.copy()
+        new_length = length.astype(np.float64)
+        order = np.argsort(chrom, kind="stable")
+        sorted_chrom = chrom[order]
+        for c, index in self._index.items():
+            lo, hi = np.searchsorted(sorted_chrom, [c, c + 1])
+            if lo < hi:
+                self._apply_chrom(index, order[lo:hi], new_start, new_end, new_length)
+        return new_start, new_end, new_length
+
+    def _apply_chrom(self, index, rows, new_start, new_end, new_length):
+        """
+        Masks the rows of one chromosome of the output arrays in place.
+        """
+        window_start, window_end, low, high, mask_cm, priority = index
+        start, end, length = new_start[rows], new_end[rows], new_length[rows]
+
+        # only regions whose window overlaps a segment can mask it
+        first = np.searchsorted(window_end, start, side="right")
+        last = np.searchsorted(window_start, end, side="left")
+        n_near = last - first
+        best = np.full(len(rows), -1, dtype=np.int64)
+        best_case = np.full(len(rows), -1, dtype=np.int64)
+        for k in range(int(n_near.max()) if len(rows) else 0):
+            near = k < n_near
+            j = np.where(near, first + k, 0)
+            l, h = low[j], high[j]
+            case = np.select([(start > l - self.flank) & (end < h + self.flank),
+                              (start <= l - self.flank) & (end >= h + self.flank),
+                              (l <= start) & (start <= h) & (h < end),
+                              (h >= end) & (end >= l) & (l > start)],
+                             [0, 1, 2, 3], -1)
+            better = near & (case >= 0) & ((best < 0) | (priority[j] < priority[np.maximum(best, 0)]))
+            best = np.where(better, j, best)
+            best_case = np.where(better, case, best_case)
+
+        # entirely masked
+        sel = best_case == 0
+        new_length[rows[sel]] = 0
+        # subtract len but keep start & end for visual display
+        sel = best_case == 1
+        new_length[rows[sel]] = length[sel] - mask_cm[best[sel]]
+        # truncate, changing start for the visual display
+        sel = best_case == 2
+        h = high[best[sel]]
+        ratio = (end[sel] - h) / (end[sel] - start[sel])
+        new_length[rows[sel]] = _round2(length[sel] * ratio)
+        new_start[rows[sel]] = h
+        # truncate, changing end for the visual display
+        sel = best_case == 3
+        l = low[best[sel]]
+        ratio = (l - start[sel]) / (end[sel] - start[sel])
+        new_length[rows[sel]] = _round2(length[sel] * ratio)
+        new_end[rows[sel]] = l
+
+
+def _round2(values):
+    """ Rounds an array to 2 decimals exactly like the builtin round() """
+    return np.array([round(v, 2) for v in values.tolist()], dtype=np.float64)
+
+
+def load_mask(path, flank=b):
+    """
+    Reads the regions to mask from a BED-like file with the
+    chromosome, start, end and length (in cM) of one region per
+    line.  Positions are used as they are, in the coordinates
+    of the input matchfiles.  Chromosome names may have a "chr"
+    prefix; regions on chromosomes that are not numbered (e.g. X)
+    are skipped, as are blank, comment, track and browser lines.
+
+    Parameters
+    ----------
+    path : str
+
+    flank : int
+        see Mask
+
+    Returns
+    -------
+    mask : Mask
+    """
+    regions = []
+    with open(path) as bed:
+        for line in bed:
+            fields = line.split()
+            if not fields or fields[0].startswith(("#", "track", "browser")):
+                continue
+            if len(fields) < 4:
+                raise ValueError("expected chromosome, start, end and cM in mask "
+                                 "line: {!r}".format(line))
+            chrom = fields[0]
+            if chrom.lower().startswith("chr"):
+                chrom = chrom[3:]
+            if not chrom.isdigit():
+                continue
+            regions.append((int(chrom), int(fields[1]), int(fields[2]), float(fields[3])))
+    return Mask(regions, flank)
+
+
+"""
+default_mask : Mask
+    the regions of masked
+"""
+default_mask = Mask((c, r[0], r[1], r[2]) for c in range(len(masked)) for r in masked[c])
+
+
+def mask_columns(chrom, bp_start, bp_end, length, mask=None):
+    """
+    Column-wise version of mask_input_segs() for segments stored
+    as arrays, which are not modified.
+
+    Parameters
+    ----------
+    chrom : numpy.ndarray[int]
+
+    bp_start : numpy.ndarray[int64]
+
+    bp_end : numpy.ndarray[int64]
+
+    length : numpy.ndarray[float64]
+
+    mask : Mask | None
+        regions to mask, default_mask if None
+
+    Returns
+    -------
+    bp_start, bp_end, length : (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        masked copies of the input columns, with length 0
+        for entirely masked segments (nothing is removed)
+    """
+    if mask is None:
+        mask = default_mask
+    return mask.apply(chrom, bp_start, bp_end, length)
+
+
+def total_masked(mask=None):
     """
     Returns the sum of the lengths of masked regions in cM
 
+    Parameters
+    ----------
+    mask : Mask | None
+        regions to mask, the regions of masked if None
+
     Returns
     -------
     m : float
     """
+    if mask is not None:
+        return mask.total()
     m = 0
     for c in masked:
         for r in c:
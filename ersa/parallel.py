@@ -0,0 +1,313 @@
+""" Estimation of pairs over a pool of processes """
+#   Copyright (c) 2015 by
+#   Richard Munoz <rmunoz@nygenome.org>
+#   Jie Yuan <jyuan@nygenome.org>
+#   Yaniv Erlich <yaniv@nygenome.org>
+#
+#   All rights reserved
+#   GPL license
+
+from ersa.ersa_LL import EstimateCache, estimate_relations
+from ersa.cache import read_arrays, write_arrays
+from ersa.parser import _mp_context
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import TemporaryDirectory
+import numpy as np
+import os
+
+
+"""
+_CHUNK_COST : int
+    target total pair_cost() of the chunks of pairs made by iter_chunks()
+"""
+_CHUNK_COST = 2 ** 17
+
+
+"""
+_WORKER : dict
+    the model and options of estimate_chunk() in a worker process,
+    set by _init_worker(), and the arrays memory mapped by _shared_arrays()
+"""
+_WORKER = {}
+
+
+"""
+_WORKER_MAPS : int
+    number of shared segment files a worker keeps memory mapped
+"""
+_WORKER_MAPS = 2
+
+
+def pair_cost(n, max_d, first_deg_adj=False):
+    """
+    Returns the approximate relative cost of estimating a pair with
+    n segments: the max_d * (n + 1) entries of its likelihood matrix,
+    plus about 100 entries for the first-degree adjustment series of
+    each segment.
+    """
+    cost = max_d * (n + 1)
+    if first_deg_adj and max_d >= 2:
+        cost += 100 * n
+    return cost
+
+
+def iter_chunks(pairs, max_d, first_deg_adj=False, chunk_cost=_CHUNK_COST):
+    """
+    Groups consecutive pairs into chunks whose total pair_cost() is
+    about chunk_cost, so that chunks take about the same time to
+    estimate; a pair costing more than chunk_cost is a chunk of its own.
+    The segments of the pairs of a chunk are rows of the same columns.
+
+    Parameters
+    ----------
+    pairs : iterable[((str, str), ersa.parser.SegmentSlice)]
+
+    Returns
+    -------
+    chunks : generator[(list[((str, str), ersa.parser.SegmentSlice)], int)]
+        the pairs of each chunk and their total cost
+    """
+    chunk, cost = [], 0
+    for item in pairs:
+        item_cost = pair_cost(len(item[1]), max_d, first_deg_adj)
+        if chunk and (cost + item_cost > chunk_cost or
+                      getattr(item[1], "cols", None) is not getattr(chunk[-1][1], "cols", None)):
+            yield chunk, cost
+            chunk, cost = [], 0
+        chunk.append(item)
+        cost += item_cost
+    if chunk:
+        yield chunk, cost
+
+
+def chunk_arrays(chunk):
+    """
+    Returns
+    -------
+    lengths, offsets : (numpy.ndarray[float], numpy.ndarray[int64])
+        the segment lengths of the pairs of chunk in CSR layout,
+        as taken by ersa_LL.estimate_relations()
+    """
+    offsets = np.zeros(len(chunk) + 1, dtype=np.int64)
+    np.cumsum([len(seg_list) for _, seg_list in chunk], out=offsets[1:])
+    first, last = chunk[0][1], chunk[-1][1]
+    if getattr(first, "cols", None) is not None and last.stop - first.start == offsets[-1]:
+        # consecutive rows of the same columns (see iter_chunks())
+        return first.cols.length[first.start:last.stop], offsets
+    lengths = np.concatenate([seg_list.length for _, seg_list in chunk])
+    return lengths, offsets
+
+
+def _pair_offsets(cols):
+    """
+    Returns the offsets of the pairs of the rows of cols, which are
+    grouped by pair, in the CSR layout of ersa.parser.PairDict.
+    """
+    lo = np.minimum(cols.indv1, cols.indv2)
+    hi = np.maximum(cols.indv1, cols.indv2)
+    starts = np.flatnonzero((lo[1:] != lo[:-1]) | (hi[1:] != hi[:-1])) + 1
+    if not len(cols):
+        return np.zeros(1, dtype=np.int64)
+    return np.concatenate(([0], starts, [len(cols)])).astype(np.int64)
+
+
+class _SharedSegments:
+    """
+    Segment lengths and pair offsets of the columns behind the
+    chunks of imap_estimates(), written once per columns to memory
+    mapped files in a temporary directory so that workers receive
+    only ranges of pairs.
+
+    Parameters
+    ----------
+    directory : str
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._files = {}        # id(cols) -> [cols, offsets, path, chunks not done]
+        self._current = None
+        self._n_files = 0
+
+    def add(self, chunk):
+        """
+        Returns the (path, first pair, last pair + 1) range of the
+        pairs of chunk, or None if they are not consecutive pairs
+        of one columns.
+        """
+        cols = getattr(chunk[0][1], "cols", None)
+        if cols is None:
+            return None
+        if id(cols) not in self._files:
+            offsets = _pair_offsets(cols)
+            path = os.path.join(self.directory, "segments_{}.npy".format(self._n_files))
+            self._n_files += 1
+            write_arrays(path, [cols.length, offsets])
+            self._files[id(cols)] = [cols, offsets, path, 0]
+            previous, self._current = self._current, id(cols)
+            if previous is not None and not self._files[previous][3]:
+                self._remove(previous)
+        entry = self._files[id(cols)]
+        offsets = entry[1]
+        first = int(np.searchsorted(offsets, chunk[0][1].start))
+        last = first + len(chunk)
+        if last >= len(offsets) or \
+                offsets[first:last].tolist() != [seg_list.start for _, seg_list in chunk] or \
+                offsets[last] != chunk[-1][1].stop:
+            return None
+        entry[3] += 1
+        return entry[2], first, last
+
+    def done(self, chunk):
+        """ Releases the file of a chunk passed to add() once it is estimated """
+        key = id(chunk[0][1].cols)
+        self._files[key][3] -= 1
+        if not self._files[key][3] and key != self._current:
+            self._remove(key)
+
+    def _remove(self, key):
+        os.remove(self._files.pop(key)[2])
+
+
+def _shared_arrays(path):
+    """ Returns the memory mapped lengths and offsets written to path by _SharedSegments """
+    maps = _WORKER.setdefault("maps", {})
+    if path not in maps:
+        while len(maps) >= _WORKER_MAPS:
+            del maps[next(iter(maps))]
+        maps[path] = read_arrays(path)
+    return maps[path]
+
+
+def _init_worker(h0, ha, max_d, alpha, ci, cache_size, prune):
+    _WORKER.update(h0=h0, ha=ha, max_d=max_d, alpha=alpha, ci=ci, prune=prune,
+                   cache=EstimateCache(cache_size) if cache_size else None)
+
+
+def estimate_range(path, first, last):
+    """
+    Worker for imap_estimates(), estimates the pairs first, ..., last - 1
+    of the segment file at path written by _SharedSegments.  See
+    estimate_chunk().
+    """
+    lengths, offsets = _shared_arrays(path)
+    rows = offsets[first:last + 1]
+    return estimate_chunk(lengths[rows[0]:rows[-1]], rows - rows[0])
+
+
+def estimate_chunk(lengths, offsets):
+    """
+    Worker for imap_estimates(), calls estimate_relations() with
+    the model of the worker.
+
+    Returns
+    -------
+    ests, hits, misses : (ersa_LL.Estimates, int, int)
+        estimates and the hits and misses of the worker's
+        EstimateCache during the call
+    """
+    w = _WORKER
+    cache = w["cache"]
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    ests = estimate_relations(lengths, offsets, w["h0"], w["ha"], w["max_d"], w["alpha"], w["ci"],
+                              cache, w["prune"])
+    if cache is not None:
+        hits, misses = cache.hits - hits, cache.misses - misses
+    return ests, hits, misses
+
+
+def imap_estimates(chunks, jobs, h0, ha, max_d, alpha, ci=False, cache=None, prune=None, window=None,
+                   tmpdir=None):
+    """
+    Estimates chunks of pairs over a pool of jobs processes and yields
+    the results in the order of chunks.
+
+    At most window chunks are read ahead of the one being yielded.
+    Among the chunks read ahead, the costliest is started first, so a
+    pair much heavier than the others starts as soon as it is read
+    instead of after the chunks before it, and does not leave a single
+    worker busy at the end.
+
+    The segment lengths of the pairs are not sent to the workers: the
+    lengths and pair offsets of each ersa.parser.MatchColumns behind the
+    pairs are written once to a file in tmpdir, which workers memory map,
+    and a chunk is sent as a range of pairs in it.  Workers return
+    columnar Estimates.
+
+    Parameters
+    ----------
+    chunks : iterable[(list[((str, str), ersa.parser.SegmentSlice)], int)]
+        chunks of pairs and their costs, see iter_chunks()
+
+    jobs : int
+        number of worker processes
+
+    h0, ha, max_d, alpha, ci :
+        see ersa_LL.estimate_relations()
+
+    cache : ersa_LL.EstimateCache | None
+        each worker keeps a cache of cache.maxsize profiles; the hits
+        and misses of all workers are added to cache
+
+    prune : ersa_LL.CriticalTable | None
+        used by every worker; the number of pruned pairs is added
+        to prune.pruned
+
+    window : int | None
+        default 8 * jobs
+
+    tmpdir : str | None
+        directory for the segment files (default: system temporary
+        directory)
+
+    Returns
+    -------
+    results : generator[(list, numpy.ndarray[float], numpy.ndarray[int64], ersa_LL.Estimates)]
+        the pairs of each chunk, their segment lengths and offsets
+        (see chunk_arrays()) and their estimates
+    """
+    window = window or 8 * jobs
+    chunks = iter(chunks)
+    ahead = {}          # chunk index -> (chunk, task, cost), not started
+    started = {}        # chunk index -> (chunk, shared, future)
+    n_read = n_done = 0
+    exhausted = False
+    cache_size = cache.maxsize if cache is not None else 0
+    with TemporaryDirectory(prefix="ersa_", dir=tmpdir) as shared_dir, \
+            ProcessPoolExecutor(max_workers=jobs, mp_context=_mp_context(), initializer=_init_worker,
+                                initargs=(h0, ha, max_d, alpha, ci, cache_size, prune)) as pool:
+        shared = _SharedSegments(shared_dir)
+        while True:
+            while not exhausted and len(ahead) + len(started) < window:
+                try:
+                    chunk, cost = next(chunks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pairs = shared.add(chunk)
+                if pairs is not None:
+                    task = (estimate_range, ) + pairs
+                else:
+                    task = (estimate_chunk, ) + chunk_arrays(chunk)
+                ahead[n_read] = (chunk, task, cost)
+                n_read += 1
+            if n_done == n_read:
+                break
+            running = sum(1 for _, _, future in started.values() if not future.done())
+            while ahead and (running < 2 * jobs or n_done not in started):
+                i = n_done if n_done not in started else max(ahead, key=lambda j: ahead[j][2])
+                chunk, task, _ = ahead.pop(i)
+                started[i] = (chunk, task[0] is estimate_range, pool.submit(*task))
+                running += 1
+
+            chunk, is_shared, future = started.pop(n_done)
+            ests, hits, misses = future.result()
+            n_done += 1
+            if is_shared:
+                shared.done(chunk)
+            if cache is not None:
+                cache.hits += hits
+                cache.misses += misses
+            if prune is not None:
+                prune.pruned += int(np.count_nonzero(ests.pruned))
+            lengths, offsets = chunk_arrays(chunk)
+            yield chunk, lengths, offsets, ests
@@ -7,8 +7,38 @@
 #   All rights reserved
 #   GPL license
 
-from ersa.mask import mask_input_segs
+from ersa.mask import mask_columns
 from sys import maxsize
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from queue import Queue, Empty
+from threading import Thread, Event
+from time import perf_counter
+import bz2
+import gzip
+import lzma
+import mmap
+import multiprocessing
+import sys
+import numpy as np
+
+
+"""
+_BLOCK_SIZE : int
+    number of bytes read from a matchfile at a time by the columnar reader
+"""
+_BLOCK_SIZE = 1 << 24
+
+
+"""
+_COMPRESSED : list[(bytes, function)]
+    leading "magic" bytes of supported compressed formats and the
+    function that opens a decompressing stream on top of a file object;
+    bgzip files are read as (multi-member) gzip
+"""
+_COMPRESSED = [(b"\x1f\x8b", lambda f: gzip.GzipFile(fileobj=f)),
+               (b"BZh", bz2.BZ2File),
+               (b"\xfd7zXZ\x00", lzma.LZMAFile)]
 
 
 class SharedSegment:
@@ -25,6 +55,8 @@ class SharedSegment:
     -----
     SharedSegments are ordered by the length parameter.
     """
+    __slots__ = ("indivID1", "indivID2", "chrom", "bpStart", "bpEnd", "length", "lengthUnit")
+
     def __init__(self, param_list):
         assert type(param_list) == list
         assert len(param_list) == 15
@@ -48,6 +80,140 @@ class SharedSegment:
         return self.length < other.length
 
 
+"""
+RECORD_DTYPE : numpy.dtype
+    layout of one MatchColumns row stored in a binary file
+"""
+RECORD_DTYPE = np.dtype([('indv1', '<i4'), ('indv2', '<i4'), ('chrom', '<i4'),
+                         ('bp_start', '<i8'), ('bp_end', '<i8'), ('length', '<f8')])
+
+
+class _PrefetchReader:
+    """
+    Reads blocks from a binary stream in a background thread and
+    hands them to the consumer through a bounded queue, so that
+    reading the stream (e.g. decompressing it) overlaps with parsing.
+
+    Parameters
+    ----------
+    stream : file object
+        binary stream to read from
+
+    close_stream : bool
+        Whether close() also closes stream
+
+    block_size : int
+        number of bytes requested from stream at a time
+
+    max_blocks : int
+        maximum number of blocks waiting in the queue
+    """
+    def __init__(self, stream, close_stream=True, block_size=_BLOCK_SIZE, max_blocks=4):
+        self._stream = stream
+        self._close_stream = close_stream
+        self._queue = Queue(maxsize=max_blocks)
+        self._stop = Event()
+        self._eof = False
+        self._thread = Thread(target=self._fill, args=(block_size,), daemon=True)
+        self._thread.start()
+
+    def _fill(self, block_size):
+        try:
+            while not self._stop.is_set():
+                data = self._stream.read(block_size)
+                self._queue.put(data)
+                if not data:
+                    break
+        except Exception as e:
+            self._queue.put(e)
+
+    def read(self, size=-1):
+        """
+        Returns the next block read from the stream, or b"" once
+        the stream is exhausted. The block size is set by the reading
+        thread, so size is ignored.
+        """
+        if self._eof:
+            return b""
+        data = self._queue.get()
+        if isinstance(data, Exception):
+            self._eof = True
+            raise data
+        if not data:
+            self._eof = True
+        return data
+
+    def close(self):
+        """ Stops the reading thread and closes the stream """
+        self._stop.set()
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except Empty:
+                pass
+        if self._close_stream:
+            self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _compressed_opener(stream):
+    """
+    Returns the function that opens a decompressing stream for
+    the format of the peekable binary stream, or None if the
+    stream is not compressed.
+    """
+    head = stream.peek(6)[:6]
+    for magic, opener in _COMPRESSED:
+        if head.startswith(magic):
+            return opener
+    return None
+
+
+def is_plain_file(path):
+    """
+    Returns True if path is a regular file that is not compressed,
+    so that it can be memory mapped or read at byte offsets.
+    """
+    if path == "-":
+        return False
+    with open(path, "rb") as f:
+        return _compressed_opener(f) is None
+
+
+def open_matchfile(path):
+    """
+    Opens a matchfile for reading in binary mode. Input compressed
+    with gzip (.gz), bgzip (.bgz), bzip2 (.bz2) or xz (.xz) is detected
+    from its contents and decompressed in a background thread
+    while it is read.
+
+    Parameters
+    ----------
+    path : str
+        path to the matchfile, or "-" to read from stdin
+
+    Returns
+    -------
+    stream : file object
+        binary stream supporting read() and use as a context manager
+    """
+    if path == "-":
+        stream, close_stream = sys.stdin.buffer, False
+    else:
+        stream, close_stream = open(path, "rb"), True
+    opener = _compressed_opener(stream)
+    if opener is not None:
+        return _PrefetchReader(opener(stream), close_stream=close_stream)
+    if not close_stream:
+        return _PrefetchReader(stream, close_stream=False)
+    return stream
+
+
 def read_matchfile(path, haploscores=False):
     """
     Reads a matchfile at path and yields SharedSegments.
@@ -55,6 +221,7 @@ def read_matchfile(path, haploscores=False):
     Parameters
     ----------
     path : str
+        see open_matchfile()
 
     haploscores : bool
         True if the input matchfile contains haploscores in an
@@ -65,13 +232,580 @@ def read_matchfile(path, haploscores=False):
     -------
     segment : generator[SharedSegment]
     """
-    with open(path) as matchfile:
-        for line in matchfile:
-            split_line = [val for val in line.split()]
-            if haploscores:
-                del split_line[-1:]
-            segment = SharedSegment(split_line)
-            yield segment
+    with open_matchfile(path) as matchfile:
+        for block in _iter_blocks(matchfile):
+            for line in block.splitlines():
+                split_line = [val.decode() for val in line.split()]
+                if haploscores:
+                    del split_line[-1:]
+                segment = SharedSegment(split_line)
+                yield segment
+
+
+class _Interner(dict):
+    """
+    Maps individual identifiers to dense integer codes, assigned
+    in the order identifiers are interned.
+    """
+    def __init__(self):
+        super(_Interner, self).__init__()
+        self.names = []
+
+    def __missing__(self, tok):
+        code = self[tok] = len(self.names)
+        self.names.append(tok.decode())
+        return code
+
+    def intern(self, tokens):
+        """
+        Parameters
+        ----------
+        tokens : list[bytes]
+            individual identifiers read from a matchfile
+
+        Returns
+        -------
+        codes : numpy.ndarray[int32]
+        """
+        return np.fromiter(map(self.__getitem__, tokens), dtype=np.int32,
+                           count=len(tokens))
+
+
+class MatchColumns:
+    """
+    Columnar storage of the matchfile fields used by ersa, with one
+    entry in each array per matchfile line.
+
+    Parameters
+    ----------
+    names : list[str]
+        individual identifiers, indexed by the codes in indv1 and indv2
+
+    indv1 : numpy.ndarray[int32]
+        codes of the first individual of each line
+
+    indv2 : numpy.ndarray[int32]
+        codes of the second individual of each line
+
+    chrom : numpy.ndarray[int32]
+
+    bp_start : numpy.ndarray[int64]
+
+    bp_end : numpy.ndarray[int64]
+
+    length : numpy.ndarray[float64]
+        segment lengths (in cM)
+    """
+    def __init__(self, names, indv1, indv2, chrom, bp_start, bp_end, length):
+        self.names = names
+        self.indv1 = indv1
+        self.indv2 = indv2
+        self.chrom = chrom
+        self.bp_start = bp_start
+        self.bp_end = bp_end
+        self.length = length
+
+    def __len__(self):
+        return len(self.length)
+
+    def take(self, rows):
+        """
+        Returns a new MatchColumns holding only the selected rows.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray[bool] | numpy.ndarray[int]
+            boolean mask or indices of the rows to keep
+        """
+        return MatchColumns(self.names, self.indv1[rows], self.indv2[rows],
+                            self.chrom[rows], self.bp_start[rows],
+                            self.bp_end[rows], self.length[rows])
+
+
+def columns_to_records(cols):
+    """
+    Packs a MatchColumns into one structured array of RECORD_DTYPE.
+
+    Returns
+    -------
+    records : numpy.ndarray[RECORD_DTYPE]
+    """
+    records = np.empty(len(cols), dtype=RECORD_DTYPE)
+    records['indv1'] = cols.indv1
+    records['indv2'] = cols.indv2
+    records['chrom'] = cols.chrom
+    records['bp_start'] = cols.bp_start
+    records['bp_end'] = cols.bp_end
+    records['length'] = cols.length
+    return records
+
+
+def records_to_columns(names, records):
+    """
+    Views a structured array of RECORD_DTYPE as a MatchColumns.
+
+    Parameters
+    ----------
+    names : list[str]
+        individual identifiers indexed by the codes in records
+
+    records : numpy.ndarray[RECORD_DTYPE]
+
+    Returns
+    -------
+    cols : MatchColumns
+    """
+    return MatchColumns(names, records['indv1'], records['indv2'], records['chrom'],
+                        records['bp_start'], records['bp_end'], records['length'])
+
+
+def _concat_columns(blocks, names):
+    """
+    Concatenates a list of MatchColumns that share names.
+
+    Returns
+    -------
+    cols : MatchColumns
+    """
+    if not blocks:
+        return MatchColumns(names, np.empty(0, np.int32), np.empty(0, np.int32),
+                            np.empty(0, np.int32), np.empty(0, np.int64),
+                            np.empty(0, np.int64), np.empty(0, np.float64))
+    if len(blocks) == 1:
+        return blocks[0]
+    return MatchColumns(names,
+                        np.concatenate([b.indv1 for b in blocks]),
+                        np.concatenate([b.indv2 for b in blocks]),
+                        np.concatenate([b.chrom for b in blocks]),
+                        np.concatenate([b.bp_start for b in blocks]),
+                        np.concatenate([b.bp_end for b in blocks]),
+                        np.concatenate([b.length for b in blocks]))
+
+
+def _iter_blocks(stream, block_size=_BLOCK_SIZE):
+    """
+    Reads a binary stream in blocks of about block_size bytes,
+    yielding each block cut after the last complete line it holds.
+    """
+    rest = b""
+    while True:
+        data = stream.read(block_size)
+        if not data:
+            break
+        data = rest + data
+        cut = max(data.rfind(b"\n"), data.rfind(b"\r")) + 1
+        rest = data[cut:]
+        if cut:
+            yield data[:cut]
+    if rest:
+        yield rest
+
+
+def _to_array(convert, tokens, dtype):
+    """ Converts a list of bytes tokens into a numpy array of dtype """
+    return np.fromiter(map(convert, tokens), dtype=dtype, count=len(tokens))
+
+
+def _parse_block(block, haploscores, interner):
+    """
+    Parses a block of complete matchfile lines into a MatchColumns.
+
+    Parameters
+    ----------
+    block : bytes
+
+    haploscores : bool
+        True if each line ends with an extra haploscore column
+
+    interner : _Interner
+        updated in place with any new individual identifiers
+
+    Returns
+    -------
+    cols : MatchColumns
+    """
+    n_fields = 16 if haploscores else 15
+    tokens = block.split()
+    assert len(tokens) % n_fields == 0
+    assert set(tokens[11::n_fields]) <= {b"cM"}
+    return MatchColumns(interner.names,
+                        interner.intern(tokens[1::n_fields]),
+                        interner.intern(tokens[3::n_fields]),
+                        _to_array(int, tokens[4::n_fields], np.int32),
+                        _to_array(int, tokens[5::n_fields], np.int64),
+                        _to_array(int, tokens[6::n_fields], np.int64),
+                        _to_array(float, tokens[10::n_fields], np.float64))
+
+
+def read_matchfile_columns(path, haploscores=False, block_size=_BLOCK_SIZE):
+    """
+    Reads a matchfile at path in blocks of about block_size bytes
+    and yields each block parsed into a MatchColumns.  All blocks
+    share one list of individual identifiers, which grows as new
+    identifiers are read.
+
+    Parameters
+    ----------
+    path : str
+        see open_matchfile()
+
+    haploscores : bool
+        True if the input matchfile contains haploscores in an
+        extra column at the end of each line. These scores
+        are discarded.
+
+    block_size : int
+
+    Returns
+    -------
+    cols : generator[MatchColumns]
+    """
+    interner = _Interner()
+    with open_matchfile(path) as matchfile:
+        for block in _iter_blocks(matchfile, block_size):
+            cols = _parse_block(block, haploscores, interner)
+            if len(cols):
+                yield cols
+
+
+def _mp_context():
+    """
+    Returns the multiprocessing context of the process pools of
+    read_matchfile_parallel() and parallel.imap_estimates().  Their
+    workers are not forked from the main process, which may run the
+    reader and writer threads of ersa.pipeline (forking a process
+    with running threads can deadlock on locks they hold).
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(["ersa.parallel"])
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+
+def _chunk_offsets(buf, n_chunks):
+    """
+    Splits buf into about n_chunks byte ranges that each end
+    right after a line break.
+
+    Returns
+    -------
+    offsets : list[int]
+        chunk i is buf[offsets[i]:offsets[i + 1]]
+    """
+    size = len(buf)
+    offsets = [0]
+    for i in range(1, n_chunks):
+        target = max(size * i // n_chunks, offsets[-1])
+        # look for a carriage return only before the next line feed,
+        # not through the rest of the file
+        lf = buf.find(b"\n", target)
+        cr = buf.find(b"\r", target, lf if lf >= 0 else size)
+        if lf < 0 and cr < 0:
+            break
+        cut = (cr if cr >= 0 else lf) + 1
+        if cut > offsets[-1]:
+            offsets.append(cut)
+    if offsets[-1] < size:
+        offsets.append(size)
+    return offsets
+
+
+def _parse_chunk(path, start, end, haploscores, t, user):
+    """
+    Worker for read_matchfile_parallel(). Parses and filters the
+    lines in bytes [start, end) of the matchfile at path.
+
+    Returns
+    -------
+    names, cols : (list[str], MatchColumns)
+        cols uses codes local to this chunk, indexing names
+    """
+    with open(path, "rb") as matchfile:
+        with mmap.mmap(matchfile.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            block = buf[start:end]
+    interner = _Interner()
+    cols = _filter_columns(_parse_block(block, haploscores, interner), t, _user_filter(user))
+    return interner.names, cols
+
+
+def read_matchfile_parallel(path, t, user=None, haploscores=False, jobs=2):
+    """
+    Reads and filters a matchfile using a pool of jobs processes.
+    The memory-mapped file is split into chunks at line breaks, each
+    chunk is parsed by a worker and the results are concatenated.
+
+    Parameters
+    ----------
+    path : str
+        uncompressed matchfile, see is_plain_file()
+
+    t : float
+        Filter out results less than t (in cM)
+
+    user : str | iterable[str] | None
+        filter input by user identification, see get_pair_dict()
+
+    haploscores : bool
+        True if the input matchfile contains haploscores in an
+        extra column at the end of each line.
+
+    jobs : int
+        number of worker processes
+
+    Returns
+    -------
+    cols : MatchColumns
+        rows of the input that pass the filters, in input order
+    """
+    with open(path, "rb") as matchfile:
+        if matchfile.seek(0, 2) == 0:
+            return _concat_columns([], [])
+        with mmap.mmap(matchfile.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            # chunks of about _BLOCK_SIZE bytes, as read by the serial reader,
+            # so that the memory used by each worker does not grow with the file
+            offsets = _chunk_offsets(buf, max(4 * jobs, len(buf) // _BLOCK_SIZE))
+
+    interner = _Interner()
+    kept = []
+    n = len(offsets) - 1
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=_mp_context()) as pool:
+        results = pool.map(_parse_chunk, [path] * n, offsets[:-1], offsets[1:],
+                           [haploscores] * n, [t] * n, [user] * n)
+        for names, cols in results:
+            codes = interner.intern([name.encode() for name in names])
+            kept.append(MatchColumns(interner.names, codes[cols.indv1], codes[cols.indv2],
+                                     cols.chrom, cols.bp_start, cols.bp_end, cols.length))
+    return _concat_columns(kept, interner.names)
+
+
+class SegmentSlice(Sequence):
+    """
+    The segments of one pair of individuals, a view on consecutive
+    rows [start, stop) of a MatchColumns.  The columns of the slice
+    are available as numpy arrays, and indexing or iterating over it
+    creates SharedSegments holding copies of the values of each row.
+
+    Parameters
+    ----------
+    cols : MatchColumns
+
+    start : int
+
+    stop : int
+    """
+    __slots__ = ("cols", "start", "stop")
+
+    def __init__(self, cols, start, stop):
+        self.cols = cols
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step == 1:
+                return _columns_to_segments(self.cols.take(slice(self.start + start, self.start + max(start, stop))))
+            return self.segments()[i]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("segment index out of range")
+        return _columns_to_segments(self.cols.take(slice(self.start + i, self.start + i + 1)))[0]
+
+    def __iter__(self):
+        return iter(self.segments())
+
+    @property
+    def chrom(self):
+        return self.cols.chrom[self.start:self.stop]
+
+    @property
+    def bp_start(self):
+        return self.cols.bp_start[self.start:self.stop]
+
+    @property
+    def bp_end(self):
+        return self.cols.bp_end[self.start:self.stop]
+
+    @property
+    def length(self):
+        return self.cols.length[self.start:self.stop]
+
+    def segments(self):
+        """
+        Returns
+        -------
+        segs : list[SharedSegment]
+        """
+        return _columns_to_segments(self.cols.take(slice(self.start, self.stop)))
+
+
+class PairDict(Mapping):
+    """
+    Read-only mapping of pairs of individuals to their segments,
+    stored in CSR layout: the rows of cols are grouped by pair, and
+    the rows of the i-th pair are cols[offsets[i]:offsets[i + 1]].
+    Pairs are keyed by tuples of integer codes into cols.names,
+    which are only looked up when results are written.
+
+    Parameters
+    ----------
+    cols : MatchColumns
+
+    offsets : numpy.ndarray[int64]
+        len(offsets) is the number of pairs + 1
+
+    Notes
+    -----
+    A key (i, j) is ordered so that names[i] < names[j].
+    """
+    def __init__(self, cols, offsets):
+        self.cols = cols
+        self.names = cols.names
+        self.offsets = offsets
+        first = offsets[:-1]
+        code1, code2 = cols.indv1[first], cols.indv2[first]
+        # rank only the names of these pairs, not all names read, which
+        # are shared by the PairDict of every block of sorted input
+        used = np.unique(np.concatenate((code1, code2)))
+        rank = np.empty(len(used), dtype=np.int64)
+        rank[np.argsort(np.array([self.names[c] for c in used.tolist()], dtype=str))] = np.arange(len(used))
+        swap = rank[np.searchsorted(used, code1)] > rank[np.searchsorted(used, code2)]
+        self.pairs = np.column_stack((np.where(swap, code2, code1),
+                                      np.where(swap, code1, code2)))
+        self._positions = None
+        self._codes = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        return map(tuple, self.pairs.tolist())
+
+    def __getitem__(self, pair):
+        if self._positions is None:
+            self._positions = {key: i for i, key in enumerate(self)}
+        return self.segments(self._positions[tuple(pair)])
+
+    def segments(self, i):
+        """ Returns the SegmentSlice of the i-th pair """
+        return SegmentSlice(self.cols, int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def key(self, indv1, indv2):
+        """
+        Returns the key of the pair of individual identifiers
+        indv1 and indv2 (in either order).  Raises ValueError for
+        identifiers that were not read.
+        """
+        if indv2 < indv1:
+            indv1, indv2 = indv2, indv1
+        # names may have grown since (it is shared by the blocks of sorted input)
+        if self._codes is None or len(self._codes) != len(self.names):
+            self._codes = {name: i for i, name in enumerate(self.names)}
+        try:
+            return self._codes[indv1], self._codes[indv2]
+        except KeyError as e:
+            raise ValueError("{} was not read".format(e.args[0])) from None
+
+    def pair_names(self, pair):
+        """ Returns the (indv1, indv2) identifiers of the key pair """
+        return self.names[pair[0]], self.names[pair[1]]
+
+    def named_items(self):
+        """
+        Returns
+        -------
+        items : generator[((str, str), SegmentSlice)]
+            pairs of individual identifiers and their segments
+        """
+        names = self.names
+        offsets = self.offsets.tolist()
+        for i, (j, k) in enumerate(self.pairs.tolist()):
+            yield (names[j], names[k]), SegmentSlice(self.cols, offsets[i], offsets[i + 1])
+
+
+def _new_segment(indivID1, indivID2, chrom, bpStart, bpEnd, length):
+    """ Creates a SharedSegment from already converted values """
+    seg = SharedSegment.__new__(SharedSegment)
+    seg.indivID1 = indivID1
+    seg.indivID2 = indivID2
+    seg.chrom = chrom
+    seg.bpStart = bpStart
+    seg.bpEnd = bpEnd
+    seg.length = length
+    seg.lengthUnit = "cM"
+    return seg
+
+
+def _columns_to_segments(cols):
+    """ Creates one SharedSegment per row of cols """
+    names = cols.names
+    return list(map(_new_segment,
+                    map(names.__getitem__, cols.indv1.tolist()),
+                    map(names.__getitem__, cols.indv2.tolist()),
+                    cols.chrom.tolist(),
+                    cols.bp_start.tolist(),
+                    cols.bp_end.tolist(),
+                    cols.length.tolist()))
+
+
+def _segments_to_columns(segs, names):
+    """
+    Packs a list of SharedSegments into a MatchColumns, where names
+    holds the identifiers of all individuals in segs.
+    """
+    codes = {name: i for i, name in enumerate(names)}
+    return MatchColumns(names,
+                        np.array([codes[s.indivID1] for s in segs], dtype=np.int32),
+                        np.array([codes[s.indivID2] for s in segs], dtype=np.int32),
+                        np.array([s.chrom for s in segs], dtype=np.int32),
+                        np.array([s.bpStart for s in segs], dtype=np.int64),
+                        np.array([s.bpEnd for s in segs], dtype=np.int64),
+                        np.array([s.length for s in segs], dtype=np.float64))
+
+
+def _pair_rows(cols):
+    """
+    Numbers the pairs of individuals of the rows of cols in order
+    of first appearance.
+
+    Returns
+    -------
+    pair_of_row, n_pairs : (numpy.ndarray[int64], int)
+    """
+    n_ids = max(len(cols.names), 1)
+    lo = np.minimum(cols.indv1, cols.indv2).astype(np.int64)
+    hi = np.maximum(cols.indv1, cols.indv2).astype(np.int64)
+    keys, first, inverse = np.unique(lo * n_ids + hi, return_index=True,
+                                     return_inverse=True)
+    rank = np.empty(len(keys), dtype=np.int64)
+    rank[np.argsort(first, kind="stable")] = np.arange(len(keys))
+    return rank[inverse.ravel()], len(keys)
+
+
+def split_pairs(cols, counts):
+    """
+    Builds a pair dictionary from rows of cols that are already
+    grouped by pair.
+
+    Parameters
+    ----------
+    cols : MatchColumns
+
+    counts : iterable[int]
+        number of consecutive rows of cols for each pair
+
+    Returns
+    -------
+    pair_dict : PairDict
+    """
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return PairDict(cols, offsets)
 
 
 def merge_segments(segs, merge_len):
@@ -79,7 +813,7 @@ def merge_segments(segs, merge_len):
     Parameters
     ----------
     segs : list[SharedSegment]
-        original input SharedSegments
+        original input SharedSegments, which are not modified
 
     merge_len
         maximum base pair between segments on
@@ -88,47 +822,74 @@ def merge_segments(segs, merge_len):
     Returns
     -------
     new_segs : list[SharedSegment]
-        modified segs with close segments merged
+        new segments with close segments merged
     """
     assert merge_len < maxsize
-    s_by_chrom = {}
-    new_segs = []
-    for seg in segs:
-        if seg.chrom in s_by_chrom:
-            s_by_chrom[seg.chrom].append(seg)
-        else:
-            s_by_chrom[seg.chrom] = [seg]
-
-    for c, s_list in s_by_chrom.items():
-        s_list.sort(key=lambda x: x.bpStart)
-        n = len(s_list)
-        diffs = []
-        for i in range(n - 1):
-            curr_end = s_list[i].bpEnd
-            next_start = s_list[i + 1].bpStart
-            diffs.append(next_start - curr_end)
-        diffs.append(maxsize)
-
-        new = None
-        for i in range(n):
-            if new:
-                if diffs[i] > merge_len:
-                    new_segs.append(new)
-                    new = None
-                else:
-                    new.bpEnd = s_list[i + 1].bpEnd
-                    new.length += s_list[i + 1].length
-            else:
-                if diffs[i] > merge_len:
-                    new_segs.append(s_list[i])
-                else:
-                    new = s_list[i]
-                    new.bpEnd = s_list[i + 1].bpEnd
-                    new.length += s_list[i + 1].length
-    return new_segs
-
-
-def get_pair_dict(path, t, user=None, haploscores=False, nomask=False, merge_len=-1):
+    names = sorted({s.indivID1 for s in segs} | {s.indivID2 for s in segs})
+    cols = _segments_to_columns(segs, names)
+    merged, _ = _merge_rows(cols, np.zeros(len(cols), dtype=np.int64), merge_len)
+    return _columns_to_segments(merged)
+
+
+def _merge_rows(cols, pair_of_row, merge_len):
+    """
+    Merges close segments on the same chromosome for the rows of all
+    pairs at once, see merge_segments().  Within each (pair, chrom)
+    group, rows are sorted by start and each row is chained to the
+    next one if the gap between them is at most merge_len.  A chain
+    becomes one row with the start of its first row, the end of its
+    last row and the sum of their lengths.
+
+    Parameters
+    ----------
+    cols : MatchColumns
+
+    pair_of_row : numpy.ndarray[int64]
+        index of the pair of each row
+
+    merge_len : int
+
+    Returns
+    -------
+    cols, pair_of_row : (MatchColumns, numpy.ndarray[int64])
+        merged rows, grouped by pair in order of index, with
+        chromosomes in order of first appearance, and the index
+        of the pair of each row
+    """
+    n = len(cols)
+    if n == 0:
+        return cols, pair_of_row
+    chrom = cols.chrom.astype(np.int64)
+    n_chrom = int(chrom.max() - chrom.min()) + 1
+    group = pair_of_row * n_chrom + (chrom - chrom.min())
+    _, first, inverse = np.unique(group, return_index=True, return_inverse=True)
+    group_first = first[inverse.ravel()]
+    order = np.lexsort((cols.bp_start, group_first, pair_of_row))
+    cols, group_first, pair_of_row = cols.take(order), group_first[order], pair_of_row[order]
+
+    new_chain = np.ones(n, dtype=bool)
+    new_chain[1:] = (group_first[1:] != group_first[:-1]) | \
+                    (cols.bp_start[1:] - cols.bp_end[:-1] > merge_len)
+    starts = np.flatnonzero(new_chain)
+    chain_len = np.diff(np.append(starts, n))
+
+    # add up lengths one chain position at a time, in the same
+    # order as a sequential sum over each chain
+    length = cols.length[starts]
+    by_len = np.argsort(-chain_len, kind="stable")
+    n_longer = np.bincount(chain_len, minlength=chain_len.max() + 1)[::-1].cumsum()[::-1]
+    for k in range(1, chain_len.max()):
+        chains = by_len[:n_longer[k + 1]]
+        length[chains] += cols.length[starts[chains] + k]
+
+    merged = MatchColumns(cols.names, cols.indv1[starts], cols.indv2[starts],
+                          cols.chrom[starts], cols.bp_start[starts],
+                          cols.bp_end[starts + chain_len - 1], length)
+    return merged, pair_of_row[starts]
+
+
+def get_pair_dict(path, t, user=None, haploscores=False, nomask=False, merge_len=-1, jobs=1,
+                  index=None, mask=None, timings=None):
     """
     Reads from path and collapses the input data into a dictionary
     mapping pairs to SharedSegments.
@@ -136,12 +897,14 @@ def get_pair_dict(path, t, user=None, haploscores=False, nomask=False, merge_len
     Parameters
     ----------
     path : str
+        see open_matchfile()
 
     t : float
         Filter out results less than t (in cM)
 
-    user : str | None
-        filter input by user identification
+    user : str | iterable[str] | None
+        filter input by user identification; with a collection
+        of users, keep pairs that involve any of them
 
     haploscores : bool
         True if the input matchfile contains haploscores in an
@@ -156,45 +919,215 @@ def get_pair_dict(path, t, user=None, haploscores=False, nomask=False, merge_len
         merge segments that are close on each chromosome.
         Thus, the default -1 means no merging.
 
+    jobs : int
+        number of processes used to parse the input, see
+        read_matchfile_parallel(); compressed input and stdin
+        are always parsed by a single process
+
+    index : ersa.index.MatchIndex | None
+        If given together with user, only the lines of the
+        user(s) listed in the index are read from path
+
+    mask : ersa.mask.Mask | None
+        regions to mask unless nomask, see mask.mask_columns()
+
+    timings : dict[str: float] | None
+        If given, the seconds spent in each step ("read", "filter"
+        and the steps of _preprocess()) are added to it
+
     Returns
     -------
-    pair_dict: dict[str: list[SharedSegments]]
-        Each list of SharedSegments is sorted for processing by
+    pair_dict: PairDict
+        The segments of each pair are sorted for processing by
         ersa_LL.estimate_relation()
     """
-    s_list = read_matchfile(path, haploscores)
-    pair_dict = {}
-    for seg in s_list:
-        assert isinstance(seg, SharedSegment)
-        assert seg.lengthUnit == "cM"
-        if seg.length < t:  # Note: seg.length > h filtered only for background parameters
-            continue
-        if user and seg.indivID1 != user and seg.indivID2 != user:
-            continue
+    if user and index is not None:
+        blocks = index.read_columns(path, user, haploscores)
+    else:
+        blocks = read_matchfile_columns(path, haploscores)
+
+    since = perf_counter()
+    if jobs > 1 and index is None and is_plain_file(path):
+        cols = read_matchfile_parallel(path, t, user, haploscores, jobs)
+        _add_time(timings, "read", since)
+    else:
+        kept = []
+        names = []
+        users = _user_filter(user)
+        for cols in blocks:
+            since = _add_time(timings, "read", since)
+            names = cols.names
+            kept.append(_filter_columns(cols, t, users))
+            since = _add_time(timings, "filter", since)
+        since = _add_time(timings, "read", since)
+        cols = _concat_columns(kept, names)
+        _add_time(timings, "filter", since)
+    return _preprocess(cols, t, nomask, merge_len, mask, timings)
+
+
+"""
+PREPROCESS_STEPS : tuple[str]
+    names of the steps timed by get_pair_dict(), in order
+"""
+PREPROCESS_STEPS = ("read", "filter", "group", "merge", "mask", "sort")
+
+
+def _add_time(timings, step, since):
+    """
+    Adds the seconds elapsed since the perf_counter() value since to
+    timings[step], unless timings is None, and returns the current
+    perf_counter() value.
+    """
+    now = perf_counter()
+    if timings is not None:
+        timings[step] = timings.get(step, 0) + now - since
+    return now
 
-        pair_id = seg.indivID1
-        if seg.indivID1 < seg.indivID2:
-            pair_id += ":" + seg.indivID2
-        else:
-            pair_id = seg.indivID2 + ":" + pair_id
-        if pair_dict.get(pair_id):
-            pair_dict[pair_id].append(seg)
-        else:
-            pair_dict[pair_id] = [seg]
-
-    remove = []
-    for pair, segs in pair_dict.items():
-        if merge_len > 0:
-            segs = merge_segments(segs, merge_len)
-            pair_dict[pair] = segs
-        if not nomask:
-            segs = mask_input_segs(segs, t)
-            pair_dict[pair] = segs
-        segs.sort()
-        if len(segs) == 0:
-            remove.append(pair)
-
-    for pair in remove:
-        del pair_dict[pair]
 
+def _preprocess(cols, t, nomask=False, merge_len=-1, mask=None, timings=None):
+    """
+    Turns filtered matchfile rows into a PairDict in one pass over
+    all pairs: rows are numbered by pair, merged, masked, dropped
+    if too short, and sorted by pair and length with a single
+    argsort, so the columns are gathered only once at the end.
+
+    Parameters
+    ----------
+    cols : MatchColumns
+        rows that passed _filter_columns()
+
+    t, nomask, merge_len, mask :
+        see get_pair_dict()
+
+    timings : dict[str: float] | None
+        If given, the seconds spent in the "group", "merge", "mask"
+        and "sort" steps are added to it
+
+    Returns
+    -------
+    pair_dict : PairDict
+        segments of each pair sorted for processing by
+        ersa_LL.estimate_relation(); pairs left with no
+        segments are removed
+    """
+    since = perf_counter()
+    pair_of_row, n_pairs = _pair_rows(cols)
+    since = _add_time(timings, "group", since)
+    if merge_len > 0:
+        cols, pair_of_row = _merge_rows(cols, pair_of_row, merge_len)
+        since = _add_time(timings, "merge", since)
+    bp_start, bp_end, length = cols.bp_start, cols.bp_end, cols.length
+    rows = slice(None)
+    if not nomask:
+        bp_start, bp_end, length = mask_columns(cols.chrom, bp_start, bp_end, length, mask)
+        rows = np.flatnonzero(length >= t)
+        since = _add_time(timings, "mask", since)
+    rows = np.arange(len(length))[rows]
+    rows = rows[np.lexsort((length[rows], pair_of_row[rows]))]
+    counts = np.bincount(pair_of_row[rows], minlength=n_pairs)
+    cols = MatchColumns(cols.names, cols.indv1[rows], cols.indv2[rows], cols.chrom[rows],
+                        bp_start[rows], bp_end[rows], length[rows])
+    pair_dict = split_pairs(cols, counts[counts > 0])
+    _add_time(timings, "sort", since)
     return pair_dict
+
+
+class _UserFilter:
+    """
+    Set-based test of whether matchfile rows involve any of a
+    collection of users.
+
+    Parameters
+    ----------
+    users : str | iterable[str]
+        one individual identifier or a collection of them
+    """
+    def __init__(self, users):
+        self.users = frozenset([users] if isinstance(users, str) else users)
+        self._names = None
+        self._is_user = np.zeros(0, dtype=bool)
+
+    def rows(self, cols):
+        """
+        Returns
+        -------
+        keep : numpy.ndarray[bool]
+            True for the rows of cols (MatchColumns) that involve a user
+        """
+        names = cols.names
+        if names is not self._names:
+            self._names = names
+            self._is_user = np.zeros(0, dtype=bool)
+        n_known = len(self._is_user)
+        if n_known < len(names):
+            new = [name in self.users for name in names[n_known:]]
+            self._is_user = np.concatenate((self._is_user, np.array(new, dtype=bool)))
+        return self._is_user[cols.indv1] | self._is_user[cols.indv2]
+
+
+def _user_filter(user):
+    """ Returns a _UserFilter for user (see get_pair_dict()), or None """
+    if not user:
+        return None
+    return _UserFilter(user)
+
+
+def _filter_columns(cols, t, users):
+    """
+    Returns the rows of cols that are at least t cM and,
+    unless users (_UserFilter) is None, involve a user.
+    """
+    keep = cols.length >= t  # Note: seg.length > h filtered only for background parameters
+    if users is not None:
+        keep &= users.rows(cols)
+    return cols.take(keep)
+
+
+def iter_sorted_pairs(path, t, user=None, haploscores=False, nomask=False, merge_len=-1,
+                      mask=None, timings=None):
+    """
+    Reads a matchfile whose lines are grouped by pair of individuals
+    and yields each pair as soon as all of its lines have been read,
+    so that only one block of the input is held in memory at a time.
+
+    Parameters are as in get_pair_dict().
+
+    Returns
+    -------
+    pairs : generator[((str, str), SegmentSlice)]
+        Pairs of individual identifiers in input order, each with
+        its segments sorted for processing by
+        ersa_LL.estimate_relation().
+        Pairs left with no segments are skipped.
+
+    Notes
+    -----
+    Lines for a pair must be consecutive in the input.  If they are
+    not, the pair is yielded more than once.
+    """
+    pending = []
+    names = []
+    users = _user_filter(user)
+    since = perf_counter()
+    for cols in read_matchfile_columns(path, haploscores):
+        since = _add_time(timings, "read", since)
+        names = cols.names
+        cols = _concat_columns(pending + [_filter_columns(cols, t, users)], names)
+        since = _add_time(timings, "filter", since)
+        if len(cols) == 0:
+            continue
+        lo = np.minimum(cols.indv1, cols.indv2)
+        hi = np.maximum(cols.indv1, cols.indv2)
+        changed = np.flatnonzero((lo[1:] != lo[:-1]) | (hi[1:] != hi[:-1]))
+        last_start = changed[-1] + 1 if len(changed) else 0
+        pending = [cols.take(slice(last_start, None))]
+        pair_dict = _preprocess(cols.take(slice(0, last_start)), t, nomask, merge_len,
+                                mask, timings)
+        for pair, segs in pair_dict.named_items():
+            yield pair, segs
+        since = perf_counter()
+    _add_time(timings, "read", since)
+    pair_dict = _preprocess(_concat_columns(pending, names), t, nomask, merge_len,
+                            mask, timings)
+    for pair, segs in pair_dict.named_items():
+        yield pair, segs
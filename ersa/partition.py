@@ -0,0 +1,201 @@
+""" Out-of-core processing of matchfiles by hash partitioning pairs """
+#   Copyright (c) 2015 by
+#   Richard Munoz <rmunoz@nygenome.org>
+#   Jie Yuan <jyuan@nygenome.org>
+#   Yaniv Erlich <yaniv@nygenome.org>
+#
+#   All rights reserved
+#   GPL license
+
+from ersa.parser import RECORD_DTYPE, read_matchfile_columns, is_plain_file, \
+    columns_to_records, records_to_columns, \
+    _add_time, _filter_columns, _preprocess, _user_filter
+from collections import OrderedDict
+from tempfile import TemporaryDirectory
+from math import ceil
+from time import perf_counter
+import numpy as np
+import os
+
+
+"""
+_MEMORY_PER_INPUT_BYTE : int
+    approximate bytes of memory needed per byte of matchfile text
+    to hold its pairs while they are merged, masked and estimated
+"""
+_MEMORY_PER_INPUT_BYTE = 4
+
+
+"""
+_COMPRESSION_RATIO : int
+    assumed ratio of uncompressed to compressed size for compressed
+    matchfiles, whose uncompressed size is not known in advance
+"""
+_COMPRESSION_RATIO = 5
+
+
+"""
+_MAX_SHARDS : int
+    largest number of shards made by n_shards_for(); a smaller
+    memory budget is exceeded instead of creating more files
+"""
+_MAX_SHARDS = 1024
+
+
+"""
+_OPEN_SHARDS : int
+    number of shard files partition_matchfile() keeps open for
+    appending across blocks
+"""
+_OPEN_SHARDS = 64
+
+
+def n_shards_for(path, memory_budget):
+    """
+    Returns the number of shards needed so that the pairs of one
+    shard of the matchfile at path fit in memory_budget, at most
+    _MAX_SHARDS.
+
+    Parameters
+    ----------
+    path : str
+        matchfile, possibly compressed (but not stdin)
+
+    memory_budget : int
+        memory available for one shard (in bytes)
+
+    Returns
+    -------
+    n_shards : int
+    """
+    assert memory_budget > 0
+    if path == "-":
+        raise ValueError("the number of shards cannot be chosen for input from stdin")
+    size = os.path.getsize(path)
+    if not is_plain_file(path):
+        size *= _COMPRESSION_RATIO
+    return min(_MAX_SHARDS, max(1, int(ceil(size * _MEMORY_PER_INPUT_BYTE / memory_budget))))
+
+
+def _pair_shard(indv1, indv2, n_shards):
+    """
+    Hashes the canonical (unordered) pair of individual codes of each
+    row to a shard number in [0, n_shards).
+    """
+    lo = np.minimum(indv1, indv2).astype(np.uint64)
+    hi = np.maximum(indv1, indv2).astype(np.uint64)
+    h = lo * np.uint64(0x9E3779B97F4A7C15) ^ hi * np.uint64(0xC2B2AE3D27D4EB4F)
+    h ^= h >> np.uint64(29)
+    return (h % np.uint64(n_shards)).astype(np.int64)
+
+
+def partition_matchfile(path, shard_dir, n_shards, t, user=None, haploscores=False):
+    """
+    Reads the matchfile at path once and writes each row that passes
+    the t and user filters to one of n_shards binary files in
+    shard_dir, so that all rows of a pair end up in the same shard.
+
+    Parameters
+    ----------
+    path : str
+
+    shard_dir : str
+        existing directory to write shard files to
+
+    n_shards : int
+
+    t : float
+        Filter out results less than t (in cM)
+
+    user : str | iterable[str] | None
+        filter input by user identification, see parser.get_pair_dict()
+
+    haploscores : bool
+        True if the input matchfile contains haploscores in an
+        extra column at the end of each line.
+
+    Returns
+    -------
+    names, shard_paths : (list[str], list[str])
+        individual identifiers indexed by the codes stored in
+        the shards, and the path of each shard file
+    """
+    shard_paths = [os.path.join(shard_dir, "shard_{}.bin".format(i))
+                   for i in range(n_shards)]
+    for p in shard_paths:
+        open(p, "wb").close()
+
+    names = []
+    users = _user_filter(user)
+    shard_files = OrderedDict()     # shard -> file open for appending, least recently used first
+    try:
+        for cols in read_matchfile_columns(path, haploscores):
+            names = cols.names
+            cols = _filter_columns(cols, t, users)
+            shard = _pair_shard(cols.indv1, cols.indv2, n_shards)
+            order = np.argsort(shard, kind="stable")
+            records = columns_to_records(cols.take(order))
+            bounds = np.searchsorted(shard[order], np.arange(n_shards + 1))
+            for i in np.flatnonzero(bounds[1:] > bounds[:-1]).tolist():
+                if i in shard_files:
+                    shard_files.move_to_end(i)
+                else:
+                    if len(shard_files) >= _OPEN_SHARDS:
+                        shard_files.popitem(last=False)[1].close()
+                    shard_files[i] = open(shard_paths[i], "ab")
+                shard_files[i].write(records[bounds[i]:bounds[i + 1]].tobytes())
+    finally:
+        for shard_file in shard_files.values():
+            shard_file.close()
+    return names, shard_paths
+
+
+def iter_partitioned_pairs(path, t, memory_budget, user=None, haploscores=False,
+                           nomask=False, merge_len=-1, tmpdir=None, mask=None, timings=None):
+    """
+    Out-of-core alternative to parser.get_pair_dict() for matchfiles
+    larger than memory. The input is hash partitioned by pair into
+    temporary shard files, which are then loaded one at a time.
+
+    Parameters
+    ----------
+    path : str
+
+    t : float
+        Filter out results less than t (in cM)
+
+    memory_budget : int
+        memory available for one shard (in bytes), which sets
+        the number of shards
+
+    user, haploscores, nomask, merge_len, mask, timings :
+        see parser.get_pair_dict(); partitioning the input
+        counts as reading it
+
+    tmpdir : str | None
+        directory to create the shard files in, or None for
+        the system default
+
+    Returns
+    -------
+    pairs : generator[((str, str), SegmentSlice)]
+        Pairs of individual identifiers shard by shard, each with
+        its segments sorted for processing by
+        ersa_LL.estimate_relation().
+        Pairs left with no segments are skipped.
+    """
+    n_shards = n_shards_for(path, memory_budget)
+    since = perf_counter()
+    with TemporaryDirectory(prefix="ersa_", dir=tmpdir) as shard_dir:
+        names, shard_paths = partition_matchfile(path, shard_dir, n_shards, t,
+                                                 user, haploscores)
+        since = _add_time(timings, "read", since)
+        for shard_path in shard_paths:
+            records = np.fromfile(shard_path, dtype=RECORD_DTYPE)
+            os.remove(shard_path)
+            cols = records_to_columns(names, records)
+            since = _add_time(timings, "read", since)
+            pair_dict = _preprocess(cols, t, nomask, merge_len, mask, timings)
+            for pair, segs in pair_dict.named_items():
+                yield pair, segs
+            since = perf_counter()
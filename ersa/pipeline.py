@@ -0,0 +1,162 @@
+""" Threads connected by bounded queues, to overlap reading, estimating and writing """
+#   Copyright (c) 2015 by
+#   Richard Munoz <rmunoz@nygenome.org>
+#   Jie Yuan <jyuan@nygenome.org>
+#   Yaniv Erlich <yaniv@nygenome.org>
+#
+#   All rights reserved
+#   GPL license
+
+from queue import Queue, Full
+from threading import Thread, Event
+
+
+"""
+_END : object
+    queued after the last item of a stage
+"""
+_END = object()
+
+
+"""
+_POLL : float
+    seconds between checks of whether the other side of a full
+    queue has stopped
+"""
+_POLL = 0.1
+
+
+class _Failure:
+    """ Queued in place of an item when a stage raises exc """
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def _put(queue, item, stop):
+    """
+    Puts item on queue, waiting while it is full, unless stop is set.
+    Returns False if stop was set before item could be put.
+    """
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=_POLL)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def iter_threaded(items, maxsize):
+    """
+    Iterates over items in a background thread.  At most maxsize
+    items wait in the queue between the thread and the consumer, so
+    the thread stops producing while the consumer falls behind.
+
+    Parameters
+    ----------
+    items : iterable
+
+    maxsize : int
+
+    Returns
+    -------
+    items : generator
+        the items, in order; exceptions raised while iterating
+        over items in the thread are raised again here
+    """
+    queue = Queue(maxsize)
+    stop = Event()
+
+    def produce():
+        try:
+            for item in items:
+                if not _put(queue, item, stop):
+                    return
+            _put(queue, _END, stop)
+        except BaseException as e:
+            _put(queue, _Failure(e), stop)
+
+    thread = Thread(target=produce, name="ersa-reader", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is _END:
+                break
+            if isinstance(item, _Failure):
+                raise item.exc
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class WriterThread:
+    """
+    Context manager running write(items) in a background thread,
+    where items iterates over the values passed to put().  put() waits
+    while maxsize values are queued.
+
+    If the with block raises, the items of write() raise
+    RuntimeError, so that a write() holding a transaction (e.g. in
+    a DbManager) rolls it back.  An exception raised by write() is
+    raised again by the next put() or on leaving the with block.
+
+    Parameters
+    ----------
+    write : callable[[iterator], None]
+
+    maxsize : int
+
+    Example
+    -------
+    with WriterThread(write_lines, 16) as writer:
+        for lines in batches:
+            writer.put(lines)
+    """
+    def __init__(self, write, maxsize):
+        self.write = write
+        self._queue = Queue(maxsize)
+        self._stop = Event()
+        self._error = None
+        self._thread = Thread(target=self._run, name="ersa-writer", daemon=True)
+
+    def _items(self):
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise RuntimeError("writing stopped by an error upstream") from item.exc
+            yield item
+
+    def _run(self):
+        try:
+            self.write(self._items())
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._stop.set()
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def put(self, item):
+        """ Queues item for write() """
+        if not _put(self._queue, item, self._stop):
+            self._check()
+            raise RuntimeError("writer stopped before reading all items")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            _put(self._queue, _END, self._stop)
+        else:
+            _put(self._queue, _Failure(exc_val), self._stop)
+        self._thread.join()
+        if exc_type is None:
+            self._check()
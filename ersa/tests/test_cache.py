@@ -0,0 +1,84 @@
+"""Unit Tests for ersa/cache.py"""
+#   Copyright (c) 2015 by
+#   Richard Munoz <rmunoz@nygenome.org>
+#   Jie Yuan <jyuan@nygenome.org>
+#   Yaniv Erlich <yaniv@nygenome.org>
+#
+#   All rights reserved
+#   GPL license
+
+
+from ersa.cache import *
+from ersa.parser import get_pair_dict
+from ersa.mask import Mask
+import numpy as np
+import os
+
+
+def test_write_read_arrays(tmpdir):
+    path = str(tmpdir.join("arrays.bin"))
+    a = np.arange(10, dtype=np.int64)
+    b = np.array(["TestA", "TestB"])
+    c = np.zeros(0, dtype=np.float64)
+    write_arrays(path, [a, b, c])
+    for mmap in [True, False]:
+        a2, b2, c2 = read_arrays(path, mmap)
+        assert list(a2) == list(a)
+        assert b2.tolist() == ["TestA", "TestB"]
+        assert len(c2) == 0
+    assert os.listdir(str(tmpdir)) == ["arrays.bin"]
+
+    umask = os.umask(0)
+    os.umask(umask)
+    assert os.stat(path).st_mode & 0o777 == 0o666 & ~umask
+
+
+def test_cache_key():
+    path = "ersa/tests/test_data/test_LL.match"
+    key = cache_key(path, 2.5)
+    assert key == cache_key(path, 2.5)
+    assert key != cache_key(path, 3)
+    assert key != cache_key(path, 2.5, user="TestA")
+    assert key != cache_key(path, 2.5, nomask=True)
+    assert key != cache_key(path, 2.5, merge_len=100)
+    assert key != cache_key("ersa/tests/test_data/test_merge.match", 2.5)
+    mask = Mask([(9, 38293483, 72605261, 8.15)])
+    assert key != cache_key(path, 2.5, mask=mask)
+    assert cache_key(path, 2.5, nomask=True) == cache_key(path, 2.5, nomask=True, mask=mask)
+
+
+def test_save_load_pair_dict(tmpdir):
+    path = "ersa/tests/test_data/test_merge.match"
+    pair_dict = get_pair_dict(path, 0, merge_len=2, nomask=True)
+    cache_path = str(tmpdir.join("test.ersacache"))
+    save_pair_dict(cache_path, pair_dict)
+    loaded = load_pair_dict(cache_path)
+    assert [pair for pair, segs in loaded.named_items()] == \
+        [pair for pair, segs in pair_dict.named_items()]
+    for pair, segs in pair_dict.named_items():
+        for s1, s2 in zip(segs, loaded[loaded.key(*pair)]):
+            assert (s1.indivID1, s1.indivID2, s1.chrom, s1.bpStart, s1.bpEnd, s1.length) == \
+                   (s2.indivID1, s2.indivID2, s2.chrom, s2.bpStart, s2.bpEnd, s2.length)
+
+
+def test_get_cached_pair_dict(tmpdir):
+    path = "ersa/tests/test_data/test_LL.match"
+    cache_dir = str(tmpdir.join("cache"))
+    pair_dict = get_cached_pair_dict(cache_dir, path, 2.5)
+    assert len(os.listdir(cache_dir)) == 1
+    cached = get_cached_pair_dict(cache_dir, path, 2.5)
+    assert len(os.listdir(cache_dir)) == 1
+    assert [pair for pair, segs in cached.named_items()] == \
+        [pair for pair, segs in pair_dict.named_items()]
+    assert len(cached[cached.key('TestA', 'TestB')]) == 7
+
+    get_cached_pair_dict(cache_dir, path, 2.5, "TestA")
+    assert len(os.listdir(cache_dir)) == 2
+
+    # an unreadable cache file is replaced by parsing the matchfile
+    cache_path = os.path.join(cache_dir, cache_key(path, 2.5) + ".ersacache")
+    with open(cache_path, "wb") as f:
+        f.write(b"not a cache file")
+    cached = get_cached_pair_dict(cache_dir, path, 2.5)
+    assert len(cached[cached.key('TestA', 'TestB')]) == 7
+    assert len(load_pair_dict(cache_path)) == 2
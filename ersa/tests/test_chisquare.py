@@ -11,6 +11,7 @@ from ersa.chisquare import *
 from scipy.stats import chi2
 from random import random, randint
 from math import log
+import numpy as np
 
 class Test_chisquare:
 
@@ -59,3 +60,18 @@ class Test_chisquare:
             for alt in alts:
                 if not LL_ratio_test(global_max_LL, alt[2], alpha, df):
                     assert alt[0] >= lower_d and alt[0] <= upper_d
+
+    def test_likelihood_ratio_tests(self):
+        LLn = np.log(np.random.random(self.num_iter))
+        LLa = LLn + np.random.random(self.num_iter) * 5
+        reject = LL_ratio_tests(LLa, LLn, 0.05)
+        for i in range(self.num_iter):
+            assert reject[i] == LL_ratio_test(LLa[i], LLn[i], 0.05)
+
+    def test_likelihood_ratio_CIs(self):
+        alt_LLs = np.log(np.random.random((self.num_iter, self.max_d)))
+        max_LLs = alt_LLs.max(axis=1)
+        lower_d, upper_d = likelihood_ratio_CIs(alt_LLs, max_LLs)
+        for i in range(self.num_iter):
+            alts = [(d, 0, alt_LL) for d, alt_LL in enumerate(alt_LLs[i].tolist(), 1)]
+            assert (lower_d[i], upper_d[i]) == likelihood_ratio_CI(alts, max_LLs[i])
@@ -11,6 +11,8 @@
 from ersa.dbmanager import *
 from ersa.parser import get_pair_dict
 from ersa.ersa_LL import Background, Relation, estimate_relation
+import pytest
+import sqlite3
 
 
 def get_test_data():
@@ -26,7 +28,7 @@ def get_test_data():
     h0 = Background(t, theta, lambda_)
     ha = Relation(c, r, t, theta, lambda_)
     dob = (None, None)
-    for pair, seg_list in pair_dict.items():
+    for pair, seg_list in pair_dict.named_items():
         s = [seg.length for seg in seg_list]
         n = len(s)
         est = estimate_relation(pair, dob, n, s, h0, ha, MAX_D, alpha)
@@ -98,3 +100,93 @@ def test_delete():
         n_deleted = db.delete()
         assert n_deleted['r'] == 6
         assert n_deleted['s'] == 30
+
+
+def test_checkpoint(tmpdir):
+    path = "sqlite:///" + str(tmpdir.join("test.db"))
+    ests, segs = [], []
+    for e, s in get_test_data():
+        ests.append(e)
+        segs.append(s)
+
+    try:
+        with DbManager(path) as db:
+            db.insert(ests[:1], segs[:1])
+            db.checkpoint()
+            db.insert(ests[1:], segs[1:])
+            raise RuntimeError
+    except RuntimeError:
+        pass
+
+    with DbManager(path) as db:
+        res = db.conn.execute(select([Result.__table__.c.indv1, Result.__table__.c.indv2])).fetchall()
+        assert [tuple(row) for row in res] == [(ests[0].indv1, ests[0].indv2)]
+
+
+def test_soft_delete_orientation():
+    with DbManager("sqlite:///", shared_pool=False) as db:
+        ests, segs = [], []
+        for e, s in get_test_data():
+            ests.append(e)
+            segs.append(s)
+
+        db.insert(ests, segs)
+        pairs = [ests[0].indv2 + ":" + ests[0].indv1, ests[0].indv1 + ":" + ests[0].indv2, 'TestX:TestY']
+        assert db.soft_delete(pairs) == 1
+        assert db.soft_delete(pairs) == 0
+        assert db.soft_delete([]) == 0
+
+        # a pair left over from a soft_delete() that failed on this connection
+        db.conn.execute(text("INSERT INTO ersa_soft_delete_pairs VALUES ('{}', '{}')"
+                             .format(ests[1].indv1, ests[1].indv2)))
+        assert db.soft_delete(['TestX:TestY']) == 0
+        res = db.conn.execute(select([Result.__table__.c.indv1]).where(~ Result.__table__.c.deleted))
+        assert [row[0] for row in res] == [ests[1].indv1]
+
+
+def test_insert_ids():
+    with DbManager("sqlite:///", shared_pool=False) as db:
+        ests, segs = [], []
+        for e, s in get_test_data():
+            ests.append(e)
+            segs.append(s)
+
+        db.insert(ests, segs)
+        db.insert(ests[::-1], segs[::-1])
+        db.insert([], [])
+
+        res = db.conn.execute(select([Result.__table__.c.id, Result.__table__.c.indv1, Result.__table__.c.n])
+                              .order_by(Result.__table__.c.id)).fetchall()
+        assert [row[0] for row in res] == [1, 2, 3, 4]
+        assert [row[1] for row in res] == [ests[0].indv1, ests[1].indv1, ests[1].indv1, ests[0].indv1]
+        for result_id, _, n in res:
+            q = select([Segment.__table__]).where(Segment.__table__.c.result_id == result_id)
+            assert len(db.conn.execute(q).fetchall()) == n
+
+
+def test_reserve_result_ids(tmpdir):
+    path = str(tmpdir.join("test.db"))
+    with DbManager("sqlite:///" + path) as db:
+        assert db._reserve_result_ids(3) == [1, 2, 3]
+        # other writers wait until the reserved ids are used and committed
+        other = sqlite3.connect(path, timeout=0)
+        with pytest.raises(sqlite3.OperationalError):
+            other.execute("BEGIN IMMEDIATE")
+        other.close()
+
+
+def test_insert_row_by_row(monkeypatch):
+    # databases where ids cannot be reserved
+    monkeypatch.setattr(Database, "_reserve_result_ids", lambda self, n: None)
+    with DbManager("sqlite:///", shared_pool=False) as db:
+        ests, segs = [], []
+        for e, s in get_test_data():
+            ests.append(e)
+            segs.append(s)
+
+        db.insert(ests, segs)
+        res = db.conn.execute(select([Result.__table__.c.id, Result.__table__.c.n])).fetchall()
+        assert len(res) == 2
+        for result_id, n in res:
+            q = select([Segment.__table__]).where(Segment.__table__.c.result_id == result_id)
+            assert len(db.conn.execute(q).fetchall()) == n
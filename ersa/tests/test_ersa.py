@@ -0,0 +1,35 @@
+"""Unit Tests for ersa/ersa.py"""
+#   Copyright (c) 2015 by
+#   Richard Munoz <rmunoz@nygenome.org>
+#   Jie Yuan <jyuan@nygenome.org>
+#   Yaniv Erlich <yaniv@nygenome.org>
+#
+#   All rights reserved
+#   GPL license
+
+
+from ersa.ersa import get_args
+import pytest
+
+
+def test_get_args_user(tmpdir):
+    args = get_args(["-u", "X", "file.match"])
+    assert args.matchfile == "file.match"
+    assert args.user == ["X"]
+
+    args = get_args(["--build-index", "-u", "X", "file.match"])
+    assert args.build_index and args.matchfile == "file.match"
+
+    users_file = tmpdir.join("users.txt")
+    users_file.write("Z\nX\n\n")
+    args = get_args(["-u", "Y", "-u", "X", "--users-file", str(users_file), "file.match"])
+    assert args.matchfile == "file.match"
+    assert args.user == ["X", "Y", "Z"]
+
+    assert get_args(["file.match"]).user is None
+
+
+def test_get_args_stdin():
+    assert get_args(["-", "--sorted-input"]).matchfile == "-"
+    with pytest.raises(SystemExit):
+        get_args(["-", "--memory-budget", "100"])
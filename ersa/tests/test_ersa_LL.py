@@ -8,10 +8,11 @@
 #   GPL license
 
 from ersa.ersa_LL import *
-from ersa.ersa_LL import _n_to_ord, _n_to_w
+from ersa.ersa_LL import _n_to_ord, _n_to_w, _log_factorial, _first_deg_series
 from ersa.parser import get_pair_dict
 import pytest
-from math import log
+import random
+from math import log, factorial
 from scipy.stats import poisson
 
 class TestBackground:
@@ -125,6 +126,65 @@ class TestRelation():
         assert max_np == 5
         assert max_mll == -8.35813328956702
 
+    def test_MLL_matches_search(self):
+        rng = random.Random(4)
+        for first_deg_adj in [False, True]:
+            self.R.first_deg_adj = first_deg_adj
+            for n in [0, 1, 2, 7, 40]:
+                s = sorted(self.t + rng.expovariate(0.1) for _ in range(n))
+                for d in [1, 2, 3, 6]:
+                    exp_mll, exp_np = None, None
+                    for np in range(n + 1):
+                        mll = self.R._LLr(np, n - np, s, d)
+                        if exp_mll is None or exp_mll < mll:
+                            exp_mll, exp_np = mll, np
+                    assert self.R.MLL(n, s, d) == (exp_np, exp_mll)
+        self.R.first_deg_adj = False
+
+    def test_MLL_all(self):
+        rng = random.Random(5)
+        for first_deg_adj in [False, True]:
+            self.R.first_deg_adj = first_deg_adj
+            for n in [0, 1, 3, 40]:
+                s = sorted(self.t + rng.expovariate(0.05) for _ in range(n))
+                exp = [(d,) + self.R.MLL(n, s, d) for d in range(1, 13)]
+                assert self.R.MLL_all(n, s, 12) == exp
+        self.R.first_deg_adj = False
+
+    def test_LLr_matrix(self):
+        s = sorted([10, 8, 6, 4, 3])
+        n = len(s)
+        LLr, base, fa = self.R._LLr_matrix(n, s, 4)
+        assert LLr.shape == (4, n + 1)
+        for d in range(1, 5):
+            for np in range(n + 1):
+                assert abs(LLr[d - 1, np] - self.R._LLr(np, n - np, s, d)) < 1e-9
+
+    def test_first_deg_series(self):
+        for i in [2.5, 4, 37.3, 99, 250, 1200]:
+            sum = 0
+            for k in range(2, 201):
+                diff = (k - 1) * log(i / 100)
+                term = 0
+                for j in range(2, k):
+                    term += log(j)
+                diff -= term
+                sum += exp(diff)
+            assert _first_deg_series(i) == log1p(sum)
+
+    def test_Fa_matrix(self):
+        s = [3, 4.5, 4.5, 10, 99]
+        for first_deg_adj in [False, True]:
+            self.R.first_deg_adj = first_deg_adj
+            fa = self.R._Fa_matrix(s, 4)
+            for d in range(1, 5):
+                assert fa[d - 1].tolist() == [self.R._Fa(i, d) for i in s]
+        self.R.first_deg_adj = False
+
+    def test_log_factorial(self):
+        for n in [30, 0, 1, 5, 171, 12]:
+            assert _log_factorial(n) == log(factorial(n))
+
 
 class TestRelationAvuncular():
     c = 1
@@ -166,18 +226,18 @@ def test_estimate_relation():
     h0 = Background(t, theta, lambda_)
     ha = Relation(c, r, t, theta, lambda_, nomask=True)
     dob = (None, None)
-    for pair, seg_list in pair_dict.items():
+    for pair, seg_list in pair_dict.named_items():
         s = [seg.length for seg in seg_list]
         n = len(s)
         est = estimate_relation(pair, dob, n, s, h0, ha, MAX_D, alpha, True)
-        if pair == 'TestA:TestB':
+        if pair == ('TestA', 'TestB'):
             assert est.null_LL == -28.77225606065412
             assert est.max_LL == -26.926635378673502
             assert not est.reject
             assert est.d == 7
             # assert est.lower_d == 6
             # assert est.upper_d == 9
-        if pair == 'TestB:TestC':
+        if pair == ('TestB', 'TestC'):
             assert est.null_LL == -16.66416439904802
             assert est.max_LL == -16.88720766845156
             assert not est.reject
@@ -186,6 +246,80 @@ def test_estimate_relation():
             # assert est.upper_d == 9
 
 
+def _flatten(seg_lists):
+    """ Returns the segment lengths and offsets of seg_lists, as taken by estimate_relations() """
+    lengths = [x for s in seg_lists for x in s]
+    offsets = [0]
+    for s in seg_lists:
+        offsets.append(offsets[-1] + len(s))
+    return lengths, offsets
+
+
+def test_estimate_relations():
+    t, theta, lambda_ = 2.5, 3.197036753, 13.73
+    h0 = Background(t, theta, lambda_)
+    rng = random.Random(6)
+    seg_lists = [sorted(t + rng.expovariate(rng.choice([0.3, 0.02])) for _ in range(n))
+                 for n in [0, 1, 1, 2, 3, 1, 12, 2, 40, 0, 3]]
+    lengths, offsets = _flatten(seg_lists)
+    for first_deg_adj in [False, True]:
+        ha = Relation(22, 35.2548101, t, theta, lambda_, first_deg_adj, nomask=True)
+        ests = estimate_relations(lengths, offsets, h0, ha, 10, 0.05, True)
+        assert len(ests) == len(seg_lists)
+        assert ests.reject.any()
+        for i, s in enumerate(seg_lists):
+            exp = estimate_relation(("A", "B"), (None, None), len(s), s, h0, ha, 10, 0.05, True)
+            est = ests.estimate(i, ("A", "B"), (None, None), s)
+            assert vars(est) == vars(exp)
+            assert ests.cm[i] == exp.cm
+
+
+def test_estimate_cache():
+    t, theta, lambda_ = 2.5, 3.197036753, 13.73
+    h0 = Background(t, theta, lambda_)
+    ha = Relation(22, 35.2548101, t, theta, lambda_, nomask=True)
+    seg_lists = [[2.6], [3.0, 9.5], [2.6], [], [3.0, 9.5], [2.6], [7.25], []]
+    lengths, offsets = _flatten(seg_lists)
+    exp = estimate_relations(lengths, offsets, h0, ha, 10, 0.05, True)
+
+    cache = EstimateCache(maxsize=2)
+    for hits, misses in [(4, 4), (8, 8)]:
+        ests = estimate_relations(lengths, offsets, h0, ha, 10, 0.05, True, cache)
+        assert (cache.hits, cache.misses) == (hits, misses)
+        assert len(cache) == 2
+        for i, s in enumerate(seg_lists):
+            assert vars(ests.estimate(i, "A:B", (None, None), s)) == \
+                vars(exp.estimate(i, "A:B", (None, None), s))
+
+    estimate_relations(lengths, offsets, h0, ha, 12, 0.05, True, cache)
+    assert cache.misses == 12
+
+
+def test_critical_table():
+    t, theta, lambda_ = 2.5, 3.197036753, 13.73
+    h0 = Background(t, theta, lambda_)
+    rng = random.Random(8)
+    seg_lists = [sorted(t + rng.expovariate(rng.choice([0.5, 0.1, 0.02])) for _ in range(n))
+                 for n in [0, 1, 1, 2, 3, 1, 2, 5, 1, 2, 3, 1, 20, 1, 1, 2] * 10]
+    lengths, offsets = _flatten(seg_lists)
+    for first_deg_adj in [False, True]:
+        ha = Relation(22, 35.2548101, t, theta, lambda_, first_deg_adj, nomask=True)
+        for alpha in [0.05, 0.001]:
+            exp = estimate_relations(lengths, offsets, h0, ha, 10, alpha, True)
+            table = CriticalTable(h0, ha, 10, alpha)
+            ests = estimate_relations(lengths, offsets, h0, ha, 10, alpha, True, prune=table)
+            assert table.pruned == ests.pruned.sum() > 0
+            assert (ests.reject == exp.reject).all()
+            assert not (ests.pruned & exp.reject).any()
+            assert (ests.null_LL == exp.null_LL).all()
+            for i, s in enumerate(seg_lists):
+                est = ests.estimate(i, "A:B", (None, None), s)
+                if ests.pruned[i]:
+                    assert est.alts == [] and est.d is None and not est.reject
+                else:
+                    assert vars(est) == vars(exp.estimate(i, "A:B", (None, None), s))
+
+
 def test_potential_relationship():
     indv1 = "A"
     indv2 = "B"
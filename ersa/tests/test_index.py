@@ -0,0 +1,92 @@
+"""Unit Tests for ersa/index.py"""
+#   Copyright (c) 2015 by
+#   Richard Munoz <rmunoz@nygenome.org>
+#   Jie Yuan <jyuan@nygenome.org>
+#   Yaniv Erlich <yaniv@nygenome.org>
+#
+#   All rights reserved
+#   GPL license
+
+
+from ersa.index import *
+from ersa.parser import get_pair_dict
+import gzip
+import pytest
+import os
+
+
+def test_build_index():
+    path = "ersa/tests/test_data/test_LL.match"
+    index = build_index(path)
+    assert index.names.tolist() == ["TestA", "TestB", "TestC"]
+    assert index.file_size == os.path.getsize(path)
+    assert index.is_current(path)
+
+    # lines are grouped by pair, so each individual has one run of lines
+    assert len(index.ranges_for("TestA")) == 1
+    assert len(index.ranges_for("TestC")) == 1
+    assert len(index.ranges_for("TestB")) == 1
+    assert len(index.ranges_for("TestD")) == 0
+    start, end = index.ranges_for("TestC")[0]
+    assert end == index.file_size
+
+    cols = list(index.read_columns(path, "TestC"))
+    assert sum(len(c) for c in cols) == 4
+    cols = list(index.read_columns(path, "TestA", block_size=10))
+    assert sum(len(c) for c in cols) == 10
+    assert list(index.read_columns(path, "TestD")) == []
+
+    # ranges of several users are merged without overlap
+    ranges = index.ranges_for(["TestA", "TestC", "TestD"])
+    assert ranges.tolist() == [[0, index.file_size]]
+    cols = list(index.read_columns(path, ["TestB", "TestC"]))
+    assert sum(len(c) for c in cols) == 14
+
+
+def test_save_load_index(tmpdir):
+    path = "ersa/tests/test_data/test_LL_haploscores.match"
+    index = build_index(path, haploscores=True)
+    idx_path = str(tmpdir.join("test.ersaidx"))
+    assert load_index(idx_path) is None
+    save_index(idx_path, index)
+    loaded = load_index(idx_path)
+    assert loaded.names.tolist() == index.names.tolist()
+    assert loaded.ranges.tolist() == index.ranges.tolist()
+    assert loaded.is_current(path)
+    assert not loaded.is_current("ersa/tests/test_data/test_LL.match")
+
+    with open(idx_path, "wb") as f:
+        f.write(b"not an index")
+    assert load_index(idx_path) is None
+
+
+def test_get_pair_dict_index(tmpdir):
+    path = "ersa/tests/test_data/test_LL.match"
+    index = build_index(path)
+    for user in ["TestA", "TestB", "TestC", "TestD", ["TestB", "TestC"], {"TestC", "TestD"}]:
+        pair_dict = get_pair_dict(path, 2.5, user)
+        indexed = get_pair_dict(path, 2.5, user, index=index)
+        assert [pair for pair, segs in indexed.named_items()] == \
+            [pair for pair, segs in pair_dict.named_items()]
+        for pair, segs in pair_dict.named_items():
+            assert [s.length for s in indexed[indexed.key(*pair)]] == [s.length for s in segs]
+
+    # individuals first read in other than sorted order
+    reversed_path = str(tmpdir.join("reversed.match"))
+    with open(path) as f, open(reversed_path, "w") as g:
+        g.writelines(reversed([line.rstrip("\n") + "\n" for line in f]))
+    save_index(index_path(reversed_path), build_index(reversed_path))
+    index = load_index(index_path(reversed_path))
+    assert index.names.tolist() == ["TestA", "TestB", "TestC"]
+    assert index.codes(["TestC", "TestD", "TestA", "Test"]).tolist() == [2, 0]
+    for user in ["TestA", "TestB", "TestC", "TestD", ["TestB", "TestC"]]:
+        pair_dict = get_pair_dict(reversed_path, 2.5, user)
+        indexed = get_pair_dict(reversed_path, 2.5, user, index=index)
+        assert [pair for pair, segs in indexed.named_items()] == \
+            [pair for pair, segs in pair_dict.named_items()]
+
+    compressed = str(tmpdir.join("test_LL.match.gz"))
+    with open(path, "rb") as f, gzip.open(compressed, "wb") as g:
+        g.write(f.read())
+    with pytest.raises(ValueError):
+        build_index(compressed)
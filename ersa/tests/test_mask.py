@@ -8,7 +8,9 @@
 #   GPL license
 
 from ersa.mask import *
+from ersa.mask import _mask_segment
 from ersa.parser import SharedSegment
+import numpy as np
 import pytest
 
 
@@ -147,3 +149,74 @@ def test_total_masked():
     m = total_masked()
     m = round(m, 3)
     assert m == 119.92
+
+
+def test_mask_columns():
+    ml = 38293483
+    mh = 72605261
+    b = 1 * 10 ** 6
+    chrom = np.array([9, 9, 9, 9, 1], dtype=np.int32)
+    bp_start = np.array([ml, ml - b, ml + 50, ml - 20 * b, 1000], dtype=np.int64)
+    bp_end = np.array([mh, mh + b, mh + 20 * b, mh - 50, 2000], dtype=np.int64)
+    length = np.array([6.29, 10.65, 10.29, 10.29, 3.0])
+    new_start, new_end, new_length = mask_columns(chrom, bp_start, bp_end, length)
+
+    segs = []
+    for i in range(len(chrom)):
+        s = SharedSegment(["0", "user1", "0", "user2", str(chrom[i]), str(bp_start[i]),
+                           str(bp_end[i]), "abc1", "abc2", "100", str(length[i]), "cM",
+                           "0", "0", "0"])
+        segs.append(s)
+    mask_input_segs(segs, 0)
+    assert new_length.tolist() == [s.length for s in segs]
+    assert new_start.tolist() == [s.bpStart for s in segs]
+    assert new_end.tolist() == [s.bpEnd for s in segs]
+    assert new_length[0] == 0
+    assert bp_start[2] == ml + 50  # input arrays are not modified
+
+
+def test_mask_engine():
+    # random segments near the default regions, masked both ways
+    rng = np.random.RandomState(0)
+    regions = [(c, r[0], r[1]) for c in range(len(masked)) for r in masked[c]]
+    pick = rng.randint(0, len(regions), 5000)
+    chrom = np.array([regions[i][0] for i in pick], dtype=np.int32)
+    center = np.array([rng.randint(regions[i][1] - 3 * b, regions[i][2] + 3 * b) for i in pick])
+    width = rng.randint(1, 40 * 10 ** 6, len(pick))
+    bp_start = np.maximum(1, center - rng.randint(0, 40 * 10 ** 6, len(pick))).astype(np.int64)
+    bp_end = bp_start + width
+    length = np.round(rng.uniform(2.5, 60, len(pick)), 2)
+
+    new_start, new_end, new_length = mask_columns(chrom, bp_start, bp_end, length)
+    expected = [_mask_segment(*row) for row in zip(chrom.tolist(), bp_start.tolist(),
+                                                   bp_end.tolist(), length.tolist())]
+    assert new_start.tolist() == [e[0] for e in expected]
+    assert new_end.tolist() == [e[1] for e in expected]
+    assert new_length.tolist() == [e[2] for e in expected]
+
+
+def test_load_mask(tmpdir):
+    path = str(tmpdir.join("mask.bed"))
+    with open(path, "w") as f:
+        f.write("track name=mask\n"
+                "# chrom start end cM\n"
+                "chr3\t5000000\t9000000\t4.5\n"
+                "\n"
+                "chrX\t100\t200\t1.0\n"
+                "3\t1000000\t6000000\t2.0\n")
+    mask = load_mask(path)
+    assert mask.regions == [(3, 5000000, 9000000, 4.5), (3, 1000000, 6000000, 2.0)]
+    assert total_masked(mask) == 6.5
+
+    # the regions overlap, and the first one listed is used
+    chrom = np.array([3, 3, 9], dtype=np.int32)
+    bp_start = np.array([4500000, 10 ** 5, 38293483], dtype=np.int64)
+    bp_end = np.array([8000000, 11 * 10 ** 6, 72605261], dtype=np.int64)
+    length = np.array([5.0, 12.0, 6.29])
+    new_start, new_end, new_length = mask_columns(chrom, bp_start, bp_end, length, mask)
+    assert new_length.tolist() == [0, 12.0 - 4.5, 6.29]
+
+    with open(path, "a") as f:
+        f.write("4\t100\n")
+    with pytest.raises(ValueError):
+        load_mask(path)
@@ -0,0 +1,96 @@
+"""Unit Tests for ersa/parallel.py"""
+#   Copyright (c) 2015 by
+#   Richard Munoz <rmunoz@nygenome.org>
+#   Jie Yuan <jyuan@nygenome.org>
+#   Yaniv Erlich <yaniv@nygenome.org>
+#
+#   All rights reserved
+#   GPL license
+
+
+from ersa.parallel import *
+from ersa.parallel import _pair_offsets
+from ersa.ersa_LL import Background, Relation, CriticalTable, EstimateCache, \
+    estimate_relation, estimate_relations
+from ersa.parser import get_pair_dict
+import numpy as np
+import os
+import random
+
+
+class _Segments:
+    """ Stand-in for the SegmentSlice of a pair, holding only lengths """
+    def __init__(self, length):
+        self.length = np.array(length, dtype=float)
+
+    def __len__(self):
+        return len(self.length)
+
+
+def _pairs(n_pairs, seed=0):
+    rng = random.Random(seed)
+    pairs = []
+    for i in range(n_pairs):
+        n = rng.choice([1, 1, 1, 2, 3, 60]) if i != n_pairs - 1 else 400
+        s = sorted(2.5 + rng.expovariate(0.1) for _ in range(n))
+        pairs.append((("A{}".format(i), "B{}".format(i)), _Segments(s)))
+    return pairs
+
+
+def test_pair_cost():
+    assert pair_cost(1, 10) == 20
+    assert pair_cost(3, 10, first_deg_adj=True) == 340
+    assert pair_cost(3, 1, first_deg_adj=True) == 4
+
+
+def test_iter_chunks():
+    pairs = _pairs(300)
+    chunks = list(iter_chunks(pairs, 10, chunk_cost=500))
+    assert [item for chunk, _ in chunks for item in chunk] == pairs
+    for chunk, cost in chunks:
+        assert cost == sum(pair_cost(len(s), 10) for _, s in chunk)
+        assert cost <= 500 or len(chunk) == 1
+    assert chunks[-1][0] == pairs[-1:]
+
+
+def test_imap_estimates():
+    h0 = Background(2.5, 3.197036753, 13.73)
+    ha = Relation(22, 35.2548101, 2.5, 3.197036753, 13.73, True, nomask=True)
+    pairs = _pairs(200, seed=1)
+    chunks = list(iter_chunks(pairs, 10, True, chunk_cost=2000))
+    cache = EstimateCache()
+    prune = CriticalTable(h0, ha, 10, 0.05)
+    results = list(imap_estimates(chunks, 2, h0, ha, 10, 0.05, True, cache, prune, window=4))
+    assert len(results) == len(chunks)
+    n_pruned = 0
+    for (chunk, _), (chunk2, lengths, offsets, ests) in zip(chunks, results):
+        assert chunk2 == chunk
+        exp = estimate_relations(lengths, offsets, h0, ha, 10, 0.05, True)
+        n_pruned += ests.pruned.sum()
+        for i, (pair, seg_list) in enumerate(chunk):
+            assert ests.reject[i] == exp.reject[i]
+            if not ests.pruned[i]:
+                assert ests.max_LL[i] == exp.max_LL[i]
+                assert ests.d[i] == exp.d[i]
+    assert cache.hits + cache.misses == len(pairs) - n_pruned
+    assert prune.pruned == n_pruned > 0
+
+
+def test_imap_estimates_shared(tmpdir):
+    t, theta, lambda_ = 2.5, 3.197036753, 13.73
+    h0 = Background(t, theta, lambda_)
+    ha = Relation(22, 35.2548101, t, theta, lambda_, nomask=True)
+    pair_dict = get_pair_dict("ersa/tests/test_data/test_LL.match", t, nomask=True)
+    assert _pair_offsets(pair_dict.cols).tolist() == pair_dict.offsets.tolist()
+
+    pairs = list(pair_dict.named_items())
+    chunks = list(iter_chunks(pairs, 10, chunk_cost=1))
+    results = list(imap_estimates(chunks, 2, h0, ha, 10, 0.05, tmpdir=str(tmpdir)))
+    assert os.listdir(str(tmpdir)) == []
+    for (chunk, _), (chunk2, lengths, offsets, ests) in zip(chunks, results):
+        assert chunk2 == chunk
+        assert lengths.tolist() == chunk[0][1].length.tolist()
+        for i, (pair, seg_list) in enumerate(chunk):
+            s = seg_list.length.tolist()
+            exp = estimate_relation(pair, (None, None), len(s), s, h0, ha, 10, 0.05)
+            assert vars(ests.estimate(i, pair, (None, None), s)) == vars(exp)
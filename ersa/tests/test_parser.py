@@ -9,6 +9,13 @@
 
 
 from ersa.parser import *
+from ersa.parser import _chunk_offsets
+import ersa.parser
+import bz2
+import gzip
+import io
+import lzma
+import sys
 import pytest
 
 
@@ -38,11 +45,47 @@ def test_read_matchfile():
 def test_get_pair_dict():
     path = "ersa/tests/test_data/test_LL.match"
     pair_dict = get_pair_dict(path, 2.5)
-    assert len(pair_dict['TestA:TestB']) == 7
+    assert len(pair_dict[pair_dict.key('TestA', 'TestB')]) == 7
+    assert pair_dict.key('TestB', 'TestA') == pair_dict.key('TestA', 'TestB')
+    with pytest.raises(ValueError):
+        pair_dict.key('TestA', 'TestD')
+    assert [pair for pair, segs in pair_dict.named_items()] == [('TestA', 'TestB'), ('TestB', 'TestC')]
 
     pair_dict = get_pair_dict(path, 2.5, "TestA")
     with pytest.raises(KeyError):
-        assert len(pair_dict['TestB:TestC']) == 9
+        assert len(pair_dict[pair_dict.key('TestB', 'TestC')]) == 9
+
+    pair_dict = get_pair_dict(path, 2.5, ["TestA", "TestC"])
+    assert sorted(pair_dict.pair_names(pair) for pair in pair_dict) == [('TestA', 'TestB'), ('TestB', 'TestC')]
+    pair_dict = get_pair_dict(path, 2.5, {"TestC", "TestD"})
+    assert [pair for pair, segs in pair_dict.named_items()] == [('TestB', 'TestC')]
+
+
+def test_pair_dict_layout():
+    path = "ersa/tests/test_data/test_LL.match"
+    pair_dict = get_pair_dict(path, 2.5)
+    assert len(pair_dict) == 2
+    assert pair_dict.offsets.tolist() == [0, 7, 10]
+    assert len(pair_dict.cols) == 10
+
+    segs = pair_dict[pair_dict.key('TestA', 'TestB')]
+    assert isinstance(segs, SegmentSlice)
+    assert len(segs) == 7
+    assert segs.length.tolist() == sorted(segs.length.tolist())
+    assert [s.length for s in segs] == segs.length.tolist()
+    assert segs[-1].length == segs.length[-1]
+    assert [segs[i].length for i in range(len(segs))] == segs.length.tolist()
+    assert [s.length for s in segs[2:5]] == segs.length[2:5].tolist()
+    assert [s.length for s in segs[::-2]] == segs.length[::-2].tolist()
+    assert segs[5:2] == []
+    with pytest.raises(IndexError):
+        segs[7]
+    with pytest.raises(IndexError):
+        segs[-8]
+    assert {s.indivID1 for s in segs} | {s.indivID2 for s in segs} == {'TestA', 'TestB'}
+
+    with pytest.raises(AttributeError):
+        segs[0].familyID1 = 0
 
 
 def test_merge_segments():
@@ -51,39 +94,160 @@ def test_merge_segments():
 
     # no merging when merge_len <= 0
     for i in range(-1, 1):
-        for pair, segs in pair_dict.items():
+        for pair, segs in pair_dict.named_items():
             n = len(segs)
             new_segs = merge_segments(segs, i)
             assert len(new_segs) == n
 
-    for pair, segs in pair_dict.items():
+    for pair, segs in pair_dict.named_items():
         new_segs = merge_segments(segs, 2)
-        if pair == 'TestA:TestB':
+        if pair == ('TestA', 'TestB'):
             assert len(new_segs) == 4
-        elif pair == 'TestB:TestC':
+        elif pair == ('TestB', 'TestC'):
             assert len(new_segs) == 3
 
-    for pair, segs in pair_dict.items():
+    for pair, segs in pair_dict.named_items():
         new_segs = merge_segments(segs, 99)
-        if pair == 'TestA:TestB':
+        if pair == ('TestA', 'TestB'):
             assert len(new_segs) == 2
-        elif pair == 'TestB:TestC':
+        elif pair == ('TestB', 'TestC'):
             assert len(new_segs) == 2
 
-    for pair, segs in pair_dict.items():
+    for pair, segs in pair_dict.named_items():
         new_segs = merge_segments(segs, 100)
-        if pair == 'TestA:TestB':
+        if pair == ('TestA', 'TestB'):
             assert len(new_segs) == 2
-        elif pair == 'TestB:TestC':
+        elif pair == ('TestB', 'TestC'):
             assert len(new_segs) == 1
 
-    for pair, segs in pair_dict.items():
+    for pair, segs in pair_dict.named_items():
         new_segs = merge_segments(segs, 500)
-        if pair == 'TestA:TestB':
+        if pair == ('TestA', 'TestB'):
             assert len(new_segs) == 2
-        elif pair == 'TestB:TestC':
+        elif pair == ('TestB', 'TestC'):
             assert len(new_segs) == 1
 
 
 
 
+
+
+def test_merge_all_pairs():
+    path = "ersa/tests/test_data/test_merge.match"
+    pair_dict = get_pair_dict(path, 0, nomask=True)
+    for merge_len in [2, 99, 100, 500]:
+        merged = get_pair_dict(path, 0, nomask=True, merge_len=merge_len)
+        for pair, segs in pair_dict.named_items():
+            segs = list(segs)
+            before = [(s.bpStart, s.bpEnd, s.length) for s in segs]
+            expected = sorted(merge_segments(segs, merge_len))
+            assert [(s.bpStart, s.bpEnd, s.length) for s in segs] == before
+            assert [(s.chrom, s.bpStart, s.bpEnd, s.length) for s in merged[merged.key(*pair)]] == \
+                [(s.chrom, s.bpStart, s.bpEnd, s.length) for s in expected]
+
+
+def test_get_pair_dict_timings():
+    path = "ersa/tests/test_data/test_merge.match"
+    timings = {}
+    get_pair_dict(path, 0, merge_len=100, timings=timings)
+    assert sorted(timings) == sorted(PREPROCESS_STEPS)
+    assert all(seconds >= 0 for seconds in timings.values())
+
+    timings = {}
+    get_pair_dict(path, 0, nomask=True, timings=timings)
+    assert "merge" not in timings and "mask" not in timings
+
+
+def test_read_matchfile_columns():
+    path = "ersa/tests/test_data/test_LL.match"
+    blocks = list(read_matchfile_columns(path))
+    assert len(blocks) == 1
+    cols = blocks[0]
+    assert len(cols) == 14
+    assert sorted(cols.names) == ["TestA", "TestB", "TestC"]
+    assert list(cols.length) == [s.length for s in read_matchfile(path)]
+
+    small_blocks = list(read_matchfile_columns(path, block_size=50))
+    assert len(small_blocks) > 1
+    assert sum(len(b) for b in small_blocks) == 14
+    assert small_blocks[0].names is small_blocks[-1].names
+
+    path = "ersa/tests/test_data/test_LL_haploscores.match"
+    cols = next(read_matchfile_columns(path, haploscores=True))
+    assert len(cols) == 14
+    assert [cols.names[i] for i in cols.indv1[:2]] == ["TestA", "TestA"]
+    assert [cols.names[i] for i in cols.indv2[:2]] == ["TestB", "TestB"]
+
+    with pytest.raises(AssertionError):
+        next(read_matchfile_columns(path))
+
+
+def test_iter_sorted_pairs():
+    path = "ersa/tests/test_data/test_LL.match"
+    pair_dict = get_pair_dict(path, 2.5)
+    pairs = list(iter_sorted_pairs(path, 2.5))
+    assert [pair for pair, segs in pairs] == [pair for pair, segs in pair_dict.named_items()]
+    for pair, segs in pairs:
+        assert [s.length for s in segs] == [s.length for s in pair_dict[pair_dict.key(*pair)]]
+
+    pairs = list(iter_sorted_pairs(path, 2.5, "TestC"))
+    assert [pair for pair, segs in pairs] == [('TestB', 'TestC')]
+
+
+def test_chunk_offsets():
+    buf = b"a b\nc d\r\ne f\rg h\n"
+    for n_chunks in range(1, 8):
+        offsets = _chunk_offsets(buf, n_chunks)
+        assert offsets[0] == 0 and offsets[-1] == len(buf)
+        assert offsets == sorted(set(offsets))
+        for o in offsets[1:]:
+            assert buf[o - 1:o] in (b"\n", b"\r")
+
+
+def test_read_matchfile_parallel(monkeypatch):
+    path = "ersa/tests/test_data/test_LL.match"
+    cols = read_matchfile_parallel(path, 2.5, jobs=3)
+    assert len(cols) == 10
+    assert list(cols.length) == [s.length for s in read_matchfile(path) if s.length >= 2.5]
+
+    # many chunks of at most about _BLOCK_SIZE bytes
+    monkeypatch.setattr(ersa.parser, "_BLOCK_SIZE", 64)
+    cols = read_matchfile_parallel(path, 2.5, jobs=2)
+    assert list(cols.length) == [s.length for s in read_matchfile(path) if s.length >= 2.5]
+    monkeypatch.undo()
+
+    cols = read_matchfile_parallel(path, 2.5, "TestC", jobs=3)
+    assert len(cols) == 3
+    assert all(cols.names[i] == "TestC" for i in cols.indv1)
+
+    pair_dict = get_pair_dict(path, 2.5)
+    parallel_dict = get_pair_dict(path, 2.5, jobs=2)
+    assert [pair for pair, segs in parallel_dict.named_items()] == \
+        [pair for pair, segs in pair_dict.named_items()]
+    for pair, segs in parallel_dict.named_items():
+        assert [s.length for s in segs] == [s.length for s in pair_dict[pair_dict.key(*pair)]]
+
+
+def test_open_matchfile(tmpdir, monkeypatch):
+    path = "ersa/tests/test_data/test_LL.match"
+    with open(path, "rb") as f:
+        data = f.read()
+    with open_matchfile(path) as f:
+        assert f.read() == data
+    assert is_plain_file(path)
+
+    for ext, module in [("gz", gzip), ("bz2", bz2), ("xz", lzma)]:
+        compressed = str(tmpdir.join("test_LL.match." + ext))
+        with module.open(compressed, "wb") as f:
+            f.write(data)
+        assert not is_plain_file(compressed)
+        with open_matchfile(compressed) as f:
+            assert b"".join(iter(f.read, b"")) == data
+        pair_dict = get_pair_dict(compressed, 2.5, jobs=2)
+        assert len(pair_dict[pair_dict.key('TestA', 'TestB')]) == 7
+
+    stdin = io.TextIOWrapper(io.BufferedReader(io.BytesIO(gzip.compress(data))))
+    monkeypatch.setattr(sys, "stdin", stdin)
+    s_list = list(read_matchfile("-"))
+    assert len(s_list) == 14
+    assert not stdin.closed
@@ -0,0 +1,62 @@
+"""Unit Tests for ersa/partition.py"""
+#   Copyright (c) 2015 by
+#   Richard Munoz <rmunoz@nygenome.org>
+#   Jie Yuan <jyuan@nygenome.org>
+#   Yaniv Erlich <yaniv@nygenome.org>
+#
+#   All rights reserved
+#   GPL license
+
+
+from ersa.partition import *
+from ersa.partition import _pair_shard, _MAX_SHARDS
+from ersa.parser import RECORD_DTYPE, get_pair_dict, read_matchfile_columns
+import ersa.partition
+import numpy as np
+import os
+
+
+def test_n_shards_for():
+    path = "ersa/tests/test_data/test_LL.match"
+    size = os.path.getsize(path)
+    assert n_shards_for(path, 10 ** 9) == 1
+    assert n_shards_for(path, size) == 4
+    assert n_shards_for(path, 4) == size
+    assert n_shards_for(path, 1) == _MAX_SHARDS
+
+
+def test_pair_shard():
+    indv1 = np.array([0, 5, 3, 7])
+    indv2 = np.array([5, 0, 7, 3])
+    shard = _pair_shard(indv1, indv2, 16)
+    assert shard[0] == shard[1]
+    assert shard[2] == shard[3]
+    assert all((shard >= 0) & (shard < 16))
+
+
+def test_partition_matchfile(tmpdir, monkeypatch):
+    path = "ersa/tests/test_data/test_LL.match"
+    names, shard_paths = partition_matchfile(path, str(tmpdir), 3, 2.5)
+    assert len(shard_paths) == 3
+    n_rows = sum(os.path.getsize(p) for p in shard_paths) // RECORD_DTYPE.itemsize
+    assert n_rows == 10
+
+    # more shards than are kept open, across many blocks
+    monkeypatch.setattr(ersa.partition, "_OPEN_SHARDS", 2)
+    monkeypatch.setattr(ersa.partition, "read_matchfile_columns",
+                        lambda path, haploscores: read_matchfile_columns(path, haploscores, block_size=64))
+    names, shard_paths = partition_matchfile(path, str(tmpdir), 7, 2.5)
+    n_rows = sum(os.path.getsize(p) for p in shard_paths) // RECORD_DTYPE.itemsize
+    assert n_rows == 10
+    assert sorted(names) == ["TestA", "TestB", "TestC"]
+
+
+def test_iter_partitioned_pairs(tmpdir):
+    path = "ersa/tests/test_data/test_LL.match"
+    pair_dict = get_pair_dict(path, 2.5)
+    for budget in [10 ** 9, 100]:
+        pairs = dict(iter_partitioned_pairs(path, 2.5, budget, tmpdir=str(tmpdir)))
+        assert sorted(pairs) == sorted(pair_dict.pair_names(pair) for pair in pair_dict)
+        for pair, segs in pairs.items():
+            assert [s.length for s in segs] == [s.length for s in pair_dict[pair_dict.key(*pair)]]
+        assert os.listdir(str(tmpdir)) == []
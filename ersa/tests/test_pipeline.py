@@ -0,0 +1,68 @@
+"""Unit Tests for ersa/pipeline.py"""
+#   Copyright (c) 2015 by
+#   Richard Munoz <rmunoz@nygenome.org>
+#   Jie Yuan <jyuan@nygenome.org>
+#   Yaniv Erlich <yaniv@nygenome.org>
+#
+#   All rights reserved
+#   GPL license
+
+
+from ersa.pipeline import *
+from pytest import raises
+
+
+def _failing(n):
+    for i in range(n):
+        yield i
+    raise ValueError("bad line")
+
+
+def test_iter_threaded():
+    assert list(iter_threaded(range(100), 3)) == list(range(100))
+
+    items = []
+    with raises(ValueError):
+        for i in iter_threaded(_failing(10), 2):
+            items.append(i)
+    assert items == list(range(10))
+
+    # stopping early ends the thread
+    for i in iter_threaded(range(1000), 1):
+        if i == 5:
+            break
+
+
+def test_writer_thread():
+    written = []
+    with WriterThread(lambda items: written.extend(items), 2) as writer:
+        for i in range(50):
+            writer.put(i)
+    assert written == list(range(50))
+
+
+def test_writer_thread_errors():
+    events = []
+
+    def write(items):
+        try:
+            for item in items:
+                events.append(item)
+        except RuntimeError:
+            events.append("rollback")
+            raise
+
+    with raises(KeyError):
+        with WriterThread(write, 1) as writer:
+            writer.put(1)
+            raise KeyError("estimation failed")
+    assert events[-1] == "rollback"
+
+    def bad_write(items):
+        for item in items:
+            raise IOError("disk full")
+
+    with raises(IOError):
+        with WriterThread(bad_write, 1) as writer:
+            for i in range(100):
+                writer.put(i)
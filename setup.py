@@ -33,10 +33,11 @@ setup(name=NAME,
       entry_points = {
           "console_scripts": ['ersa = ersa.ersa:main']
       },
-      install_requires=['sqlalchemy', 'inflect', 'pytest', 'scipy'],
+      python_requires='>=3.7',
+      install_requires=['sqlalchemy', 'inflect', 'pytest', 'numpy>=1.17', 'scipy>=1.3'],
       classifiers=['Development Status :: 4 - Beta',
                    'Intended Audience :: Science/Research',
-                   'Programming Language :: Python :: 3.4',
+                   'Programming Language :: Python :: 3.7',
                    'Programming Language :: Python :: 3 :: Only',
                    'License :: OSI Approved :: GNU General Public License v3 (GPLv3)',
                    'Operating System :: OS Independent',